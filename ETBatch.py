@@ -0,0 +1,89 @@
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from ETV2 import *
+
+# Batch evaluation of many expressions for many environments (dictionaries with the values of the variables)
+# The environments are split into chunks, and the chunks are evaluated by a pool of worker processes.
+# The expressions are sent to every worker once, as bytecode (see Expression.to_bytecode and
+# Bytecode.tobytes), instead of as pickled trees. The chunks are sent as rows of values
+# in a fixed order of the variable names instead of as dictionaries.
+
+#---Worker processes-----------------------------------------------------------------------------
+
+# Bytecode and variable names of the expressions, set once in every worker by startWorker
+WorkerCode=None
+WorkerNames=None
+
+# Initializer of a worker: reads the bytecode of the expressions
+def startWorker(data,names):
+    global WorkerCode,WorkerNames
+    WorkerCode=[Bytecode.frombytes(code) for code in data]
+    WorkerNames=names
+
+# Evaluates the expressions (bytecode) codes for a chunk of rows of values of the variables names,
+# returns one list of values per row. A missing value in a row is None
+def evaluateChunk(rows,codes,names):
+    results=[]
+    for row in rows:
+        env={name:value for name,value in zip(names,row) if value is not None}
+        results.append([code.run(env) for code in codes])
+    return results
+
+# evaluateChunk in a worker, with the bytecode set by startWorker
+def workerChunk(rows):
+    return evaluateChunk(rows,WorkerCode,WorkerNames)
+
+#---END Worker processes-------------------------------------------------------------------------
+
+# Yields chunks of at most size rows from the environments
+def chunks(environments,names,size):
+    chunk=[]
+    for env in environments:
+        chunk.append(tuple(env.get(name) for name in names))
+        if len(chunk)==size:
+            yield chunk
+            chunk=[]
+    if chunk:
+        yield chunk
+
+# Evaluates every expression for every environment, e.g.
+# for values in evaluateBatch([x+y,x*y],[{'x':1,'y':2},{'x':3,'y':4}]): print(values) -> [3.0,2.0], [7.0,12.0]
+# Yields, in the order of the environments, the list of values of the expressions for that environment
+# environments can be any iterable (also a generator), it is read as the results are consumed:
+# at most 2 chunks per worker are waiting or running at the same time, so memory stays bounded
+# workers is the number of processes (default: the number of CPUs), with workers=0 everything is
+# evaluated in this process
+# An error in a worker (e.g. a missing variable or a division by zero) is raised here
+def evaluateBatch(expressions,environments,workers=None,chunksize=1000):
+    codes=[expr.to_bytecode() for expr in expressions]
+    names=sorted(set(name for code in codes for name in code.names))
+    if workers==0:
+        # The bytecode is local to this generator (not in the globals of the workers), so several generators
+        # can be used at the same time
+        for chunk in chunks(environments,names,chunksize):
+            yield from evaluateChunk(chunk,codes,names)
+        return
+
+    data=[code.tobytes() for code in codes]
+    workers=workers or os.cpu_count() or 1
+    pool=ProcessPoolExecutor(max_workers=workers,initializer=startWorker,initargs=(data,names))
+    try:
+        pending=deque()
+        for chunk in chunks(environments,names,chunksize):
+            pending.append(pool.submit(workerChunk,chunk))
+            # Results come back in the order in which the chunks were submitted
+            while len(pending)>=2*workers:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+    finally:
+        pool.shutdown(wait=True,cancel_futures=True)
+
+
+if __name__=='__main__':
+    # Example: the expressions of ET.py for a range of values of x and y
+    expressions=[Expression.fromString('(2+x)*y-(3-y)**3'),Expression.fromString('(2*y)**3-(3-x)')]
+    environments=[{'x':x/10,'y':x/20} for x in range(10)]
+    for env,values in zip(environments,evaluateBatch(expressions,environments,workers=2,chunksize=3)):
+        print(env,values)
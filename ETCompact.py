@@ -0,0 +1,309 @@
+import sys
+from array import array
+# (explicit names, so a name in ETV2 cannot shadow the array class above)
+from ETV2 import Expression, Constant, Variable, Basic, BinaryNode, AddNode, SubtractNode, MultiplyNode, \
+    DivideNode, PowerNode, Functions, Operators, isnumber, postorder
+
+# Compact representation of expression trees
+# The nodes are stored in postorder (children before their parent) in three parallel arrays:
+#   ops: the opcode of every node (array('B'), 1 byte per node)
+#   lhs: for a binary operation the index of the left child, for a leaf the index in its table (array('i'))
+#   rhs: for a binary operation the index of the right child, -1 for a leaf (array('i'))
+# The values of constants, the names of variables and the (funchar,varchar) of functions are kept in
+# separate tables, so equal leaves are stored once. The last node is the root.
+# A node that is shared by several parents (a DAG) is stored once as well.
+# All methods are loops over the arrays, so trees of any depth can be converted, evaluated,
+# differentiated and printed without recursion.
+# To store many small formulas, a finished expression is packed (see pack): the arrays have no spare room, the
+# tables are tuples and the index of the leaves is dropped, it is rebuilt when a leaf is appended again.
+
+# Opcodes
+CONST,VAR,FUNC,ADD,SUB,MUL,DIV,POW=range(8)
+OpCodes={'+':ADD,'-':SUB,'*':MUL,'/':DIV,'**':POW}
+OpSymbols={ADD:'+',SUB:'-',MUL:'*',DIV:'/',POW:'**'}
+NodeClasses={ADD:AddNode,SUB:SubtractNode,MUL:MultiplyNode,DIV:DivideNode,POW:PowerNode}
+
+# Derivatives of the basic functions: function -> (factor, function) where factor*function(x) is the derivative
+# Note: log has the derivative 1/x, which is not a basic function (see CompactExpression.diff)
+BasicDerivatives={'sin':(1,'cos'),'cos':(-1,'sin'),'-sin':(-1,'cos'),'-cos':(1,'sin')}
+
+
+#---Class: CompactExpression--------------------------------------------------------------------
+
+class CompactExpression():
+
+    __slots__=('ops','lhs','rhs','constants','variables','functions','index')
+
+    def __init__(self):
+        self.ops=array('B')
+        self.lhs=array('i')
+        self.rhs=array('i')
+        self.constants=[]
+        self.variables=[]
+        self.functions=[]
+        # Position of every leaf in its table, so equal leaves are stored once (None: packed, see pack)
+        self.index={}
+
+    # Number of nodes
+    def __len__(self):
+        return len(self.ops)
+
+    # Memory used by the expression (in bytes): the object, its arrays and its tables with their entries
+    # (entries that are shared with other objects, e.g. the names of variables, are counted as well)
+    def nbytes(self):
+        size=sys.getsizeof(self)+sum(sys.getsizeof(a) for a in [self.ops,self.lhs,self.rhs])
+        for table in [self.constants,self.variables,self.functions]:
+            size+=sys.getsizeof(table)+sum(sys.getsizeof(key) for key in table)
+        if self.index is not None:
+            size+=sys.getsizeof(self.index)
+        return size
+
+    # Overload: String str, the same string as str(toTree())
+    def __str__(self):
+        return str(self.toTree())
+
+    #---Building--------------------------------------------------------------------------------
+
+    # Appends a node, returns its index
+    def append(self,op,l,r=-1):
+        self.ops.append(op)
+        self.lhs.append(l)
+        self.rhs.append(r)
+        return len(self.ops)-1
+
+    # Appends a leaf, returns its index
+    # op is CONST, VAR or FUNC, the key (value, name or (funchar,varchar)) is stored in the table of that kind
+    def leaf(self,op,key):
+        if self.index is None:
+            self.unpack()
+        tables={CONST:self.constants,VAR:self.variables,FUNC:self.functions}
+        # Note: 1 and 1.0 are different constants (they print differently)
+        position=self.index.get((op,type(key),key))
+        if position is None:
+            position=len(tables[op])
+            tables[op].append(key)
+            self.index[(op,type(key),key)]=position
+        return self.append(op,position)
+
+    # Frees the memory that is only needed to append leaves: the spare room of the arrays, the lists of the
+    # tables (these become tuples) and the index of the leaves; returns the expression itself
+    def pack(self):
+        self.ops=array('B',self.ops)
+        self.lhs=array('i',self.lhs)
+        self.rhs=array('i',self.rhs)
+        self.constants=tuple(self.constants)
+        self.variables=tuple(self.variables)
+        self.functions=tuple(self.functions)
+        self.index=None
+        return self
+
+    # Undoes pack (for leaf): the tables become lists again and the index is rebuilt
+    def unpack(self):
+        self.constants=list(self.constants)
+        self.variables=list(self.variables)
+        self.functions=list(self.functions)
+        self.index={}
+        for op,table in [(CONST,self.constants),(VAR,self.variables),(FUNC,self.functions)]:
+            for position,key in enumerate(table):
+                self.index.setdefault((op,type(key),key),position)
+
+    # Builds the compact version of an expression tree (a DAG stays a DAG)
+    @staticmethod
+    def fromTree(expr):
+        compact=CompactExpression()
+        positions={}
+        for node in postorder(expr):
+            if isinstance(node,BinaryNode):
+                positions[id(node)]=compact.append(OpCodes[node.op_symbol],positions[id(node.lhs)],positions[id(node.rhs)])
+            elif isinstance(node,Constant):
+                positions[id(node)]=compact.leaf(CONST,node.value)
+            elif isinstance(node,(int,float)):
+                positions[id(node)]=compact.leaf(CONST,Constant(node).value)
+            elif isinstance(node,Variable):
+                positions[id(node)]=compact.leaf(VAR,node.char)
+            elif isinstance(node,Basic):
+                positions[id(node)]=compact.leaf(FUNC,(node.funchar,node.varchar))
+            else:
+                raise ValueError('Cannot store node: %s' % node)
+        return compact.pack()
+
+    # Builds the expression tree, nodes that are stored once are shared in the tree
+    def toTree(self):
+        nodes=[]
+        for op,l,r in zip(self.ops,self.lhs,self.rhs):
+            if op==CONST:
+                nodes.append(Constant(self.constants[l]))
+            elif op==VAR:
+                nodes.append(Variable(self.variables[l]))
+            elif op==FUNC:
+                nodes.append(Basic(*self.functions[l]))
+            else:
+                nodes.append(NodeClasses[op](nodes[l],nodes[r]))
+        return nodes[-1]
+
+    # Returns a copy with only the nodes (and table entries) that are needed for the node root
+    def prune(self,root=None):
+        if root is None:
+            root=len(self.ops)-1
+        # Children come before their parent, so one backward sweep finds all nodes below root
+        needed=bytearray(root+1)
+        needed[root]=1
+        for i in range(root,-1,-1):
+            if needed[i] and self.ops[i]>=ADD:
+                needed[self.lhs[i]]=1
+                needed[self.rhs[i]]=1
+        tables={CONST:self.constants,VAR:self.variables,FUNC:self.functions}
+        result=CompactExpression()
+        positions={}
+        for i in range(root+1):
+            if needed[i]:
+                op=self.ops[i]
+                if op>=ADD:
+                    positions[i]=result.append(op,positions[self.lhs[i]],positions[self.rhs[i]])
+                else:
+                    positions[i]=result.leaf(op,tables[op][self.lhs[i]])
+        return result.pack()
+
+    #---END Building----------------------------------------------------------------------------
+
+    #---Evaluation------------------------------------------------------------------------------
+
+    # Evaluates the expression to a number, the values of all variables should be given in Dic
+    # (a variable '-x' also takes the value of x)
+    def evaluate(self,Dic={}):
+        values=[]
+        for op,l,r in zip(self.ops,self.lhs,self.rhs):
+            if op>=ADD:
+                values.append(Operators[OpSymbols[op]](values[l],values[r]))
+            elif op==CONST:
+                value=self.constants[l]
+                if not isnumber(value):
+                    raise ValueError('Cannot evaluate non-numerical constant: %s' % value)
+                values.append(value)
+            elif op==VAR:
+                values.append(self.value(self.variables[l],Dic))
+            else:
+                funchar,varchar=self.functions[l]
+                name=funchar.lstrip('-')
+                if name not in Functions:
+                    raise ValueError('Cannot evaluate unknown function: %s' % funchar)
+                value=Functions[name](self.value(varchar,Dic))
+                values.append(-value if funchar[0]=='-' else value)
+        return values[-1]
+
+    # Value of a variable in Dic
+    def value(self,char,Dic):
+        if char in Dic:
+            return Dic[char]
+        elif char[0]=='-' and char[1:] in Dic:
+            return -Dic[char[1:]]
+        elif '-'+char in Dic:
+            return -Dic['-'+char]
+        raise ValueError('No value for variable: %s' % char)
+
+    #---END Evaluation--------------------------------------------------------------------------
+
+    #---Derivative------------------------------------------------------------------------------
+
+    # Derivative to var, with the same rules as BinaryNode.diff, as a new CompactExpression
+    # The derivatives are appended after a copy of the nodes of this expression (so they can refer
+    # to them), afterwards the nodes that are not needed are dropped (see prune)
+    # Terms with a zero derivative are left out, e.g. the derivative of x*2 is 2*1 instead of 2*1+0*x
+    def diff(self,var):
+        result=self.prune()
+        n=len(result.ops)
+        # Index of the derivative of every node, None if the derivative is 0
+        derivatives=[]
+        for i in range(n):
+            op,l,r=result.ops[i],result.lhs[i],result.rhs[i]
+            if op==CONST:
+                d=None
+            elif op==VAR:
+                char=result.variables[l]
+                if char==var:
+                    d=result.leaf(CONST,1)
+                elif char.lstrip('-')==var.lstrip('-'):
+                    d=result.leaf(CONST,-1)
+                else:
+                    d=None
+            elif op==FUNC:
+                d=result.difffunction(result.functions[l],var)
+            else:
+                d=result.rule(op,l,r,derivatives[l],derivatives[r])
+            derivatives.append(d)
+        if derivatives[-1] is None:
+            result=CompactExpression()
+            result.leaf(CONST,0)
+            return result.pack()
+        return result.prune(derivatives[-1])
+
+    # Appends the derivative of a basic function, returns its index (or None if it is 0)
+    def difffunction(self,function,var):
+        funchar,varchar=function
+        if varchar!=var:
+            return None
+        if funchar in BasicDerivatives:
+            factor,name=BasicDerivatives[funchar]
+            return self.leaf(FUNC,(name if factor==1 else '-'+name,varchar))
+        if funchar in ['log','-log']:
+            return self.append(DIV,self.leaf(CONST,-1 if funchar[0]=='-' else 1),self.leaf(VAR,varchar))
+        raise ValueError('Cannot differentiate unknown function: %s' % funchar)
+
+    # Appends the derivative of the operation op with children l and r, given the derivatives dl and dr
+    # of the children (None for 0), returns its index (or None if it is 0)
+    def rule(self,op,l,r,dl,dr):
+        if dl is None and dr is None:
+            return None
+        # Sum rule
+        if op==ADD:
+            if dl is None:
+                return dr
+            if dr is None:
+                return dl
+            return self.append(ADD,dl,dr)
+        # Difference rule
+        if op==SUB:
+            if dr is None:
+                return dl
+            return self.append(SUB,self.leaf(CONST,0) if dl is None else dl,dr)
+        # Product rule
+        if op==MUL:
+            terms=[]
+            if dl is not None:
+                terms.append(self.append(MUL,r,dl))
+            if dr is not None:
+                terms.append(self.append(MUL,dr,l))
+            return terms[0] if len(terms)==1 else self.append(ADD,terms[0],terms[1])
+        # Quotient rule
+        if op==DIV:
+            if dr is None:
+                numerator=self.append(MUL,r,dl)
+            elif dl is None:
+                numerator=self.append(SUB,self.leaf(CONST,0),self.append(MUL,dr,l))
+            else:
+                numerator=self.append(SUB,self.append(MUL,r,dl),self.append(MUL,dr,l))
+            return self.append(DIV,numerator,self.append(MUL,r,r))
+        # Power rule
+        # Note: as in BinaryNode.diff, the exponent is assumed to be constant
+        if op==POW:
+            if dl is None:
+                return None
+            power=self.append(POW,l,self.append(SUB,r,self.leaf(CONST,1)))
+            return self.append(MUL,self.append(MUL,r,power),dl)
+
+    #---END Derivative--------------------------------------------------------------------------
+
+#---END Class: CompactExpression----------------------------------------------------------------
+
+
+if __name__=='__main__':
+    # Example: the expression of ET.py, its derivative and a tree that is too deep for recursion
+    compact=CompactExpression.fromTree(Expression.fromString('(2+x)*y-(3-y)**3'))
+    print(compact, '=', compact.evaluate({'x':1,'y':2}))
+    print('d/dy:', compact.diff('y'))
+    deep=CompactExpression()
+    node=deep.leaf(VAR,'x')
+    for i in range(10**5):
+        node=deep.append(ADD,node,deep.leaf(CONST,1))
+    print('%d nodes, %d bytes: x+1+...+1 =' % (len(deep),deep.nbytes()), deep.evaluate({'x':0}))
+    print('derivative:', deep.diff('x').evaluate({'x':0}))
@@ -0,0 +1,172 @@
+import time
+import ETV2
+from ETV2 import Expression, Constant, Variable, Function, BinaryNode
+
+# Opt-in instrumentation of the main operations of ETV2.py: evaluate, diff, __str__, __eq__ and fromString
+# For every call the wall time, the number of node visits (see Traversals) and the number of allocated nodes
+# are counted, and these are added up per operation and per expression (equal expressions, i.e. with the same
+# hash, or the same string for fromString).
+# e.g.
+#   with profiling() as profile:
+#       expr.diff('x').evaluate({'x':1})
+#   print(profile.report())
+# The operations are only replaced by counting versions inside the with-block (or between enable and disable),
+# outside it the original methods are used, so there is no cost at all when the instrumentation is disabled.
+
+# The operations that are measured: name -> (class, attribute)
+Operations={'evaluate':(BinaryNode,'evaluate'),'diff':(BinaryNode,'diff'),'__str__':(BinaryNode,'__str__'),
+            '__eq__':(BinaryNode,'__eq__'),'fromString':(Expression,'fromString')}
+
+# Constructors that count allocations (the subclasses of BinaryNode and Basic use these)
+Constructors=[Constant,Variable,Function,BinaryNode]
+
+# Number of nodes visited by a call of a traversal, given its result
+# (a chain a+b+c of BinaryNode.operands visits its BinaryNodes, 2 here, and the operands that are leaves)
+def chainsize(operands):
+    return len(operands)-1+sum(1 for operand in operands if not isinstance(operand,BinaryNode))
+
+# The functions that visit nodes: (owner, attribute) -> number of visited nodes, given the result
+# postorder is the traversal of evaluate, diff and __str__, BinaryNode.operands that of canonical and __hash__
+# (so of __eq__), and the parser (fromString) visits one node per primary expression and per operator
+Traversals={(ETV2,'postorder'):len,(BinaryNode,'operands'):chainsize,
+            (ETV2,'parsePrimary'):lambda result: 1,(ETV2,'reduceOperator'):lambda result: 1}
+
+# The profile that is enabled (at most one at a time)
+active=None
+
+#---Class: Profile-------------------------------------------------------------------------------
+
+class Profile():
+
+    def __init__(self):
+        # operation -> [calls, visits, allocations, time]
+        self.operations={}
+        # (operation, key) -> [calls, visits, allocations, time]; labels: (operation, key) -> short string
+        self.expressions={}
+        self.labels={}
+        # Counters [visits, allocations] of the operations that are running (the outermost one counts)
+        self.running=[]
+        # Original methods, while enabled
+        self.originals={}
+
+    # Overload: with-statement, the profile is enabled inside the block
+    def __enter__(self):
+        self.enable()
+        return self
+
+    def __exit__(self,*exception):
+        self.disable()
+        return False
+
+    # Replaces the operations, the constructors and the traversals by counting versions
+    def enable(self):
+        global active
+        if active is not None:
+            raise RuntimeError('A profile is already enabled')
+        active=self
+        for name,(cls,attribute) in Operations.items():
+            self.originals[(cls,attribute)]=cls.__dict__[attribute]
+            setattr(cls,attribute,self.operation(name,cls.__dict__[attribute]))
+        for cls in Constructors:
+            self.originals[(cls,'__init__')]=cls.__dict__['__init__']
+            setattr(cls,'__init__',self.constructor(cls.__dict__['__init__']))
+        for (owner,attribute),count in Traversals.items():
+            self.originals[(owner,attribute)]=getattr(owner,attribute)
+            setattr(owner,attribute,self.traversal(getattr(owner,attribute),count))
+
+    # Restores the original methods
+    def disable(self):
+        global active
+        for (owner,attribute),original in self.originals.items():
+            setattr(owner,attribute,original)
+        self.originals={}
+        active=None
+
+    #---Counting versions------------------------------------------------------------------------
+
+    # Counting version of an operation (a function or a staticmethod)
+    def operation(self,name,original):
+        static=isinstance(original,staticmethod)
+        function=original.__func__ if static else original
+        def counting(*args,**kwargs):
+            # Operations inside another operation are counted as part of the outer operation
+            if self.running:
+                return function(*args,**kwargs)
+            counters=[0,0]
+            self.running.append(counters)
+            start=time.perf_counter()
+            try:
+                return function(*args,**kwargs)
+            finally:
+                elapsed=time.perf_counter()-start
+                # A copy of the counters: the work of add itself (e.g. str for the label) is not counted
+                self.add(name,args[0],list(counters),elapsed)
+                self.running.pop()
+        return staticmethod(counting) if static else counting
+
+    # Counting version of a constructor
+    def constructor(self,original):
+        def counting(node,*args,**kwargs):
+            if self.running:
+                self.running[-1][1]+=1
+            original(node,*args,**kwargs)
+        return counting
+
+    # Counting version of a traversal, count gives the number of visited nodes from the result
+    def traversal(self,original,count):
+        def counting(*args,**kwargs):
+            result=original(*args,**kwargs)
+            if self.running:
+                self.running[-1][0]+=count(result)
+            return result
+        return counting
+
+    # Adds the counters of one call to the totals of the operation and of the expression
+    # (the key and label are computed while the operation still counts as running, so they are not recorded as
+    # operations of their own, and counters is a copy made before, so their visits and allocations are not added)
+    def add(self,name,subject,counters,elapsed):
+        key=subject if isinstance(subject,str) else (type(subject).__name__,hash(subject))
+        if (name,key) not in self.labels:
+            label=subject if isinstance(subject,str) else str(subject)
+            self.labels[(name,key)]=label if len(label)<=50 else label[:47]+'...'
+        for totals in [self.operations.setdefault(name,[0,0,0,0.0]),self.expressions.setdefault((name,key),[0,0,0,0.0])]:
+            totals[0]+=1
+            totals[1]+=counters[0]
+            totals[2]+=counters[1]
+            totals[3]+=elapsed
+
+    #---END Counting versions--------------------------------------------------------------------
+
+    # Report as a string: the totals per operation, and the expressions with the largest total time
+    def report(self,top=10):
+        lines=['%12s %10s %12s %12s %12s %14s' % ('operation','calls','visits','allocations','time (s)','time/call (s)')]
+        for name,(calls,visits,allocations,elapsed) in sorted(self.operations.items(),key=lambda item: -item[1][3]):
+            lines.append('%12s %10d %12d %12d %12.6f %14.8f' % (name,calls,visits,allocations,elapsed,elapsed/calls))
+        lines.append('')
+        lines.append('%12s %10s %12s %12s %12s  %s' % ('operation','calls','visits','allocations','time (s)','expression'))
+        ranked=sorted(self.expressions.items(),key=lambda item: -item[1][3])[:top]
+        for (name,key),(calls,visits,allocations,elapsed) in ranked:
+            lines.append('%12s %10d %12d %12d %12.6f  %s' % (name,calls,visits,allocations,elapsed,self.labels[(name,key)]))
+        return '\n'.join(lines)
+
+#---END Class: Profile---------------------------------------------------------------------------
+
+# Context manager: profiling() returns a new Profile that is enabled inside the with-block
+def profiling():
+    return Profile()
+
+# Prints the report of a profile
+def report(profile,top=10):
+    print(profile.report(top))
+
+
+if __name__=='__main__':
+    # Example: parse, differentiate, evaluate, print and compare
+    with profiling() as profile:
+        for i in range(100):
+            expr=Expression.fromString('x*sin(x)/(x+%d)' % (i%10))
+            derivative=expr.diff('x')
+            derivative.evaluate({'x':1.5})
+            str(derivative)
+            derivative==expr.diff('x')
+    report(profile)
@@ -0,0 +1,87 @@
+import csv
+import sys
+import numpy as np
+from ETV2 import *
+
+# Streaming evaluation of expressions over (large) CSV files
+# The file is read in chunks of rows, the columns of a chunk are converted to NumPy arrays and bound to
+# the variables with the same name (the names in the header), the expressions are evaluated for the whole
+# chunk at once (see Expression.evaluate_array) and the results are written before the next chunk is read.
+# So the memory that is used depends on the size of a chunk, not on the size of the file.
+
+# Reads a CSV file (with a header) in chunks, yields for every chunk a dictionary: column name -> array
+# Only the columns in names are converted (default: all columns), to float64 if possible, else to strings
+# The columns in text are always kept as strings
+def readChunks(source,chunksize=100000,names=None,delimiter=',',text=()):
+    reader=csv.reader(source,delimiter=delimiter)
+    header=next(reader)
+    names=header if names is None else names
+    for name in names:
+        if name not in header:
+            raise ValueError('No column: %s' % name)
+    positions=[header.index(name) for name in names]
+    rows=[]
+    for row in reader:
+        rows.append(row)
+        if len(rows)==chunksize:
+            yield columns(rows,names,positions,text)
+            rows=[]
+    if rows:
+        yield columns(rows,names,positions,text)
+
+# Converts a list of rows to a dictionary: column name -> array
+def columns(rows,names,positions,text=()):
+    chunk={}
+    for name,k in zip(names,positions):
+        column=[row[k] for row in rows]
+        if name in text:
+            chunk[name]=np.array(column)
+            continue
+        try:
+            chunk[name]=np.array(column,dtype=np.float64)
+        except ValueError:
+            chunk[name]=np.array(column)
+    return chunk
+
+# Evaluates expressions for all rows of a CSV file and writes the results to a CSV file, e.g.
+# evaluateCSV({'area':'SepalLengthCm*SepalWidthCm'},'Iris.csv','area.csv',keep=['Id'])
+# expressions maps the names of the output columns to expressions (Expression's or strings),
+# keep is a list of input columns that are copied (as text) to the output, before the results
+# source and target are file names or open files, returns the number of rows
+def evaluateCSV(expressions,source,target,chunksize=100000,keep=(),delimiter=','):
+    expressions={name:Expression.fromString(expr) if isinstance(expr,str) else expr for name,expr in expressions.items()}
+    # Only the columns that are used are converted
+    variables=set(name for expr in expressions.values() for name in expr.variables())
+    names=list(keep)+sorted(variables.difference(keep))
+
+    infile=open(source,newline='') if isinstance(source,str) else source
+    outfile=open(target,'w',newline='') if isinstance(target,str) else target
+    try:
+        writer=csv.writer(outfile,delimiter=delimiter)
+        writer.writerow(list(keep)+list(expressions))
+        count=0
+        # (if no columns are used at all, e.g. for constant expressions, all columns are read)
+        for chunk in readChunks(infile,chunksize,names or None,delimiter,text=keep):
+            n=len(next(iter(chunk.values())))
+            results=[chunk[name] for name in keep]
+            # Kept columns that are also variables are converted for the expressions
+            env=dict(chunk)
+            for name in variables.intersection(keep):
+                env[name]=np.asarray(chunk[name],dtype=np.float64)
+            for expr in expressions.values():
+                # A constant expression gives one value for the whole chunk
+                results.append(np.broadcast_to(expr.evaluate_array(env),(n,)))
+            writer.writerows(zip(*[column.tolist() for column in results]))
+            count+=n
+        return count
+    finally:
+        if isinstance(source,str):
+            infile.close()
+        if isinstance(target,str):
+            outfile.close()
+
+
+if __name__=='__main__':
+    # Example: derived features of the Iris data
+    expressions={'SepalArea':'SepalLengthCm*SepalWidthCm','PetalRatio':'PetalLengthCm/PetalWidthCm'}
+    evaluateCSV(expressions,'Iris.csv',sys.stdout,chunksize=50,keep=['Id','Species'])
@@ -1,30 +1,39 @@
 import math
+from array import array
+import numbers
+import json
+import keyword
+import operator
+import re
+import struct
+import sys
+from collections import OrderedDict
+import weakref
+
+# NumPy is optional, it is only needed for evaluate_array
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Pattern for one token (after optional spaces): a number, a name, or an operator, parenthesis or comma
+TokenPattern=re.compile(r'\s*(?:(\d+\.?\d*(?:[eE][-+]?\d+)?|\.\d+(?:[eE][-+]?\d+)?)|([A-Za-z_]\w*)|(\*\*|[-+*/(),]))')
 
 # Splits a string into mathematical tokens
-# Returns a list of numbers, operators, parenthesis and commas
+# Returns a list of numbers, names (of variables and functions), operators, parenthesis and commas
 # Output will not contain spaces
+# Scans the string once from left to right with TokenPattern
 def tokenize(string):
-    splitchars = list("+-*/(),")
-    
-    # Surrounds any splitchar by spaces, numbers are left alone
-    tokenstring = []
-    for c in string:
-        if c in splitchars:
-            tokenstring.append(' %s ' % c)
-        else:
-            tokenstring.append(c)
-    tokenstring = ''.join(tokenstring)
-    # Splits on spaces - this gives us our tokens
-    tokens = tokenstring.split()
-    
-    # Checks for double *'s and converts them to **'s:
-    ans = []
-    for t in tokens:
-        if len(ans) > 0 and t == ans[-1] == '*':
-            ans[-1] = '**'
-        else:
-            ans.append(t)
-    return ans
+    tokens=[]
+    pos=0
+    end=len(string.rstrip())
+    while pos<end:
+        match=TokenPattern.match(string,pos)
+        if match is None:
+            raise ValueError('Unknown token: %s' % string[pos:].split()[0])
+        tokens.append(match.group(match.lastindex))
+        pos=match.end()
+    return tokens
 
 # Checks is a string represents a expression (by checking for operators)
 def isexp(string):
@@ -65,8 +74,413 @@ def ispos(string):
     except Exception:
         return not str(string)[0]=='-'
 
+# Sets an attribute of an (immutable) node, only for use in __init__ and for caches
+setattribute=object.__setattr__
+
+# Checks a number that is a child of a BinaryNode: an int or float is kept, other real numbers (e.g. the scalars
+# of NumPy) become an int or float, other values (also bool) raise a TypeError
+def childnumber(value,node):
+    if isinstance(value,bool):
+        pass
+    elif isinstance(value,(int,float)):
+        return value
+    elif isinstance(value,numbers.Integral):
+        return int(value)
+    elif isinstance(value,numbers.Real):
+        return float(value)
+    raise TypeError('Child of %s should be an Expression or a number, not %s' % (type(node).__name__,type(value).__name__))
+
+# Python functions for the arithmetic operators
+Operators={'+':operator.add,'-':operator.sub,'*':operator.mul,'/':operator.truediv,'**':operator.pow}
+
+# Python functions for the basic functions (see the class Basic)
+Functions={'sin':math.sin,'cos':math.cos,'log':math.log}
+
+# Lists the nodes of an expression in postorder (children before their parent)
+# A node that is shared by several parents is only listed once
+# If expand is given, the children of a BinaryNode are only listed if expand(node) is True
+# Uses an explicit stack instead of recursion, so deep trees are no problem
+def postorder(root,expand=None):
+    order=[]
+    seen=set()
+    stack=[(root,False)]
+    while stack:
+        node,expanded=stack.pop()
+        if expanded:
+            order.append(node)
+        elif id(node) not in seen:
+            seen.add(id(node))
+            if isinstance(node,BinaryNode) and (expand is None or expand(node)):
+                stack.append((node,True))
+                stack.append((node.rhs,False))
+                stack.append((node.lhs,False))
+            else:
+                order.append(node)
+    return order
+
+# Canonical form of an expression (see BinaryNode.canonical), Python numbers count as Constant's
+def canonical(expr):
+    if isinstance(expr,(int,float)):
+        return ('Constant',0,expr)
+    return expr.canonical()
+
+# Hash of an expression, Python numbers have the same hash as Constant's
+def hashof(expr):
+    if isinstance(expr,(int,float)):
+        return hash(('Constant',expr))
+    return hash(expr)
+
+# Sorts canonical forms, given their hashes: by hash, and only if different forms have the same hash
+# also by the forms themselves (comparing nested tuples takes long for large subtrees)
+def sortcanonical(hashes,keys):
+    order=sorted(range(len(keys)),key=lambda i: hashes[i])
+    result=[]
+    start=0
+    while start<len(order):
+        end=start+1
+        while end<len(order) and hashes[order[end]]==hashes[order[start]]:
+            end+=1
+        run=[keys[i] for i in order[start:end]]
+        if not all(samecanonical(run[0],key) for key in run[1:]):
+            run.sort()
+        result.extend(run)
+        start=end
+    return tuple(result)
+
+# Checks if two canonical forms are equal, without recursion
+# Pairs of tuples are compared only once, as canonical forms of shared subtrees are shared tuples
+def samecanonical(a,b):
+    stack=[(a,b)]
+    seen=set()
+    while stack:
+        a,b=stack.pop()
+        if a is b:
+            continue
+        if type(a)==tuple and type(b)==tuple:
+            if len(a)!=len(b):
+                return False
+            if (id(a),id(b)) not in seen:
+                seen.add((id(a),id(b)))
+                stack.extend(zip(a,b))
+        elif type(a)==tuple or type(b)==tuple or a!=b:
+            return False
+    return True
+
+#---Parser-------------------------------------------------------------------------------------
+
+# Binary operators: precedence and right-associativity
+# Unary minus has precedence UnaryPrec: -x**2 is -(x**2), but -x*y is (-x)*y
+BinaryOperators={'+':(1,False),'-':(1,False),'*':(2,False),'/':(2,False),'**':(4,True)}
+UnaryPrec=3
+
+# Operator-precedence parsing with explicit stacks of operands and operators (no recursion, so deeply nested
+# expressions can be parsed), the operators on the stack are '(', the binary operators, and 'u-' and 'u+' for
+# unary minus and plus
+# Parses the tokens from position pos on, until the end or a token that cannot follow (e.g. an unmatched ')')
+# Returns the expression tree and the position of the first token that is not used
+def parseExpression(tokens,pos):
+    operands=[]
+    operators=[]
+    operand=True
+    while True:
+        if operand:
+            # Expected: a unary operator, '(' or a primary expression
+            if pos>=len(tokens):
+                raise ValueError('Unexpected end of expression')
+            token=tokens[pos]
+            if token in ['-','+']:
+                operators.append('u'+token)
+                pos+=1
+            elif token=='(':
+                operators.append(token)
+                pos+=1
+            else:
+                expr,pos=parsePrimary(tokens,pos)
+                operands.append(expr)
+                operand=False
+            continue
+        # Expected: a binary operator or ')'
+        token=tokens[pos] if pos<len(tokens) else None
+        if token in BinaryOperators:
+            prec,right=BinaryOperators[token]
+            # A left-associative operator first reduces the operators with the same precedence on its left
+            while operators and operators[-1]!='(' and (operatorPrecedence(operators[-1])>prec or (operatorPrecedence(operators[-1])==prec and not right)):
+                reduceOperator(operands,operators.pop())
+            operators.append(token)
+            operand=True
+            pos+=1
+        elif token==')' and '(' in operators:
+            while operators[-1]!='(':
+                reduceOperator(operands,operators.pop())
+            operators.pop()
+            pos+=1
+        else:
+            break
+    while operators:
+        if operators[-1]=='(':
+            raise ValueError('Missing right parenthesis')
+        reduceOperator(operands,operators.pop())
+    return operands[0],pos
+
+# Precedence of an operator on the stack of parseExpression
+def operatorPrecedence(op):
+    if op in ['u-','u+']:
+        return UnaryPrec
+    return BinaryOperators[op][0]
+
+# Applies the operator op to the operands on the top of the stack of parseExpression
+def reduceOperator(operands,op):
+    if op=='u-':
+        operands[-1]=-operands[-1]
+    elif op!='u+':
+        rhs=operands.pop()
+        # Operator overloading takes care of building the node
+        operands[-1]=Operators[op](operands[-1],rhs)
+
+# Parses a number, a variable or a function call
+# Names are tested first: a token of tokenize is a name if and only if it is an identifier, so names such as
+# nan and inf are variables (isnumber would accept them)
+def parsePrimary(tokens,pos):
+    token=tokens[pos]
+    
+    # Names: function calls and variables
+    if token.isidentifier():
+        if pos+1<len(tokens) and tokens[pos+1]=='(':
+            if token not in Functions:
+                raise ValueError('Unknown function: %s' % token)
+            if pos+2>=len(tokens):
+                raise ValueError('Unexpected end of expression')
+            # Note: at the moment functions are leaves, so the argument has to be a variable
+            if not tokens[pos+2].isidentifier() or (pos+3<len(tokens) and tokens[pos+3]!=')'):
+                raise ValueError('The argument of %s should be a variable' % token)
+            if pos+3>=len(tokens):
+                raise ValueError('Missing right parenthesis')
+            return Basic(token,tokens[pos+2]),pos+4
+        return Variable(token),pos+1
+
+    # Numbers
+    elif isnumber(token):
+        return Constant(token),pos+1
+
+    else:
+        raise ValueError('Unexpected token: %s' % token)
+
+# Parses a string without using the cache
+def parseString(string):
+    tokens=tokenize(string)
+    if tokens==[]:
+        raise ValueError('Empty expression')
+    expr,pos=parseExpression(tokens,0)
+    if pos<len(tokens):
+        raise ValueError('Unexpected token: %s' % tokens[pos])
+    return expr
+
+# Removes all spaces that do not separate tokens, e.g. ' 2 *x+ sin( y ) ' -> '2*x+sin(y)'
+# Spaces between names/numbers and between two '*' are replaced by one space
+def normalize(string):
+    string=string.strip()
+    def replace(match):
+        before=string[match.start()-1]
+        after=string[match.end()]
+        if (before.isalnum() or before in '_.') and (after.isalnum() or after in '_.'):
+            return ' '
+        elif before==after=='*':
+            return ' '
+        else:
+            return ''
+    return re.sub(r'\s+',replace,string)
+
+#---END Parser---------------------------------------------------------------------------------
+
+
+#---Class: ParseCache--------------------------------------------------------------------------
+
+# Least recently used (LRU) cache of parsed expressions, keyed on the normalized string
+# When more than maxsize strings are stored, the least recently used one is removed
+# e.g. ParseCache.default.resize(10000), ParseCache.default.info(), ParseCache.default.clear()
+class ParseCache():
+
+    def __init__(self,maxsize=1024):
+        self.maxsize=maxsize
+        self.trees=OrderedDict()
+        self.hits=0
+        self.misses=0
+
+    def __len__(self):
+        return len(self.trees)
+
+    # Returns the tree of string, from the cache if possible
+    def parse(self,string):
+        key=normalize(string)
+        if key in self.trees:
+            self.hits+=1
+            self.trees.move_to_end(key)
+            return self.trees[key]
+        self.misses+=1
+        tree=parseString(key)
+        if self.maxsize>0:
+            self.trees[key]=tree
+            if len(self.trees)>self.maxsize:
+                self.trees.popitem(last=False)
+        return tree
+
+    # Changes the maximal number of stored trees, removes the least recently used trees if needed
+    def resize(self,maxsize):
+        self.maxsize=maxsize
+        while len(self.trees)>max(maxsize,0):
+            self.trees.popitem(last=False)
+
+    # Removes all trees and resets the counters
+    def clear(self):
+        self.trees.clear()
+        self.hits=0
+        self.misses=0
+
+    # Counters of the cache
+    def info(self):
+        return {'hits':self.hits,'misses':self.misses,'size':len(self.trees),'maxsize':self.maxsize}
+
+#---END Class: ParseCache----------------------------------------------------------------------
+
+# The cache used by Expression.fromString
+ParseCache.default=ParseCache()
+
+
+#---Class: Rendering-----------------------------------------------------------------------------
+
+# Represents the string of an expression while BinaryNode.__str__ builds it
+# Short strings are stored as text, long strings as a list of parts (strings and Renderings) that
+# is joined only once at the end (tostring), so building the string of a tree takes linear time
+# For long strings we keep the facts that the simplifications and brackets in __str__ depend on:
+# the first two characters c0,c1 and whether there is an operator in the string from the 2nd (ops1)
+# or 3rd character (ops2) on
+# Note: c1 and ops2 are only needed (and known) for strings that start with '-'
+class Rendering():
+
+    # Strings shorter than this are stored as text
+    Short=32
+
+    def __init__(self,text=None,parts=None,skip=0,c0=None,c1=None,ops1=None,ops2=None):
+        self.text=text
+        self.parts=parts
+        self.skip=skip
+        self.c0=c0
+        self.c1=c1
+        self.ops1=ops1
+        self.ops2=ops2
+
+    # Concatenates strings and Renderings into a new Rendering
+    def concat(*pieces):
+        pieces=[Rendering(piece) if type(piece)==str else piece for piece in pieces]
+        # Short strings are joined directly, just like '-'+text (which might be a number)
+        if all(piece.text is not None for piece in pieces):
+            text=''.join(piece.text for piece in pieces)
+            if len(text)<Rendering.Short or len(pieces)==2:
+                return Rendering(text)
+        first=pieces[0]
+        rest=any(piece.hasop() for piece in pieces[2:])
+        if first.text is not None and len(first.text)==1:
+            c1=pieces[1].first()
+            ops1=pieces[1].hasop() or rest
+            ops2=pieces[1].hasop(1) or rest
+        else:
+            c1=first.second()
+            ops1=first.hasop(1) or pieces[1].hasop() or rest
+            ops2=first.hasop(2) or pieces[1].hasop() or rest
+        return Rendering(parts=pieces,c0=first.first(),c1=c1,ops1=ops1,ops2=ops2)
+    
+    # First and second character
+    def first(self):
+        if self.text is not None:
+            return self.text[0]
+        return self.c0
+
+    def second(self):
+        if self.text is not None:
+            return self.text[1] if len(self.text)>1 else None
+        return self.c1
+
+    # Checks if the string contains an operator from character number start on
+    def hasop(self,start=0):
+        if self.text is not None:
+            return any(c in '+-/*' for c in self.text[start:])
+        if start==0:
+            return self.c0 in '+-/*' or self.ops1
+        elif start==1:
+            return self.ops1
+        else:
+            return self.ops2
+
+    # The same as isint, isexp and ispos for the string
+    # Strings that are not stored as text are never numbers, as they contain spaces or brackets
+    def isint(self):
+        return self.text is not None and isint(self.text)
+
+    def intvalue(self):
+        return int(float(self.text))
+
+    def isexp(self):
+        if self.text is not None:
+            return isexp(self.text)
+        if self.c0=='-':
+            return self.c1 in ['+','-','/','*']
+        return self.hasop()
+
+    def ispos(self):
+        if self.text is not None:
+            return ispos(self.text)
+        return not self.c0=='-'
+
+    # The string without its first character
+    # Note: this is only used for strings that start with '-'
+    def strip(self):
+        if self.text is not None:
+            return Rendering(self.text[1:])
+        return Rendering(parts=[self],skip=1,c0=self.c1,ops1=self.ops2)
+
+    # Joins all parts into one string, without recursion
+    def tostring(self):
+        output=[]
+        # Number of characters that still have to be skipped
+        skip=0
+        stack=[self]
+        while stack:
+            piece=stack.pop()
+            if piece.text is None:
+                # The characters to skip are at the start of this piece
+                skip+=piece.skip
+                stack.extend(reversed(piece.parts))
+            elif skip>=len(piece.text):
+                skip-=len(piece.text)
+            else:
+                output.append(piece.text[skip:])
+                skip=0
+        return ''.join(output)
+
+#---END Class: Rendering-------------------------------------------------------------------------
+
+# String of the negation -a of the expression a, given the Rendering S of a
+def negated(expr,S):
+    if isinstance(expr,BinaryNode):
+        # -a is 0-a for trees
+        return SubtractNode(Constant(0),expr).render(Rendering('0'),S)
+    return Rendering(str(-expr))
+
 # Represents an expression tree or an constant, variable or basic function
+# Nodes are immutable: their attributes are set once in __init__, and cannot be changed or deleted afterwards
+# (only the caches of a BinaryNode are filled in later, with values that follow from the node itself),
+# so trees can safely be shared between threads, caches and other trees
+# All classes use __slots__, so nodes have no __dict__
 class Expression():
+
+    __slots__=('__weakref__',)
+
+    # Overload: attribute assignment and deletion, nodes are immutable
+    def __setattr__(self,name,value):
+        raise AttributeError('%s is immutable, cannot set %s' % (type(self).__name__,name))
+
+    def __delattr__(self,name):
+        raise AttributeError('%s is immutable, cannot delete %s' % (type(self).__name__,name))
     
     # Overload: arithmetics
     def __add__(self, other):
@@ -86,81 +500,224 @@ class Expression():
     
     def __neg__(self):
         return SubtractNode(Constant(0),self)
-        
-    #---Shunting-yard algorithm-------------------------------------------------
-    
-    def fromString(string):
-        # Splits into tokens
-        tokens = tokenize(string)
-        
-        # Stack used by the Shunting-Yard algorithm
-        stack = []
-        # Output of the algorithm: a list representing the formula in RPN
-        # This will contain Constant's and operators
-        output = []
-        
-        # List of operators
-        oplist = ['+','-','*','/','**']
 
-        # Precedence of operators, '(' has value 0, so that the stack is treated as 'empty' if '(' is on top of the stack
-        Prec={'(':0,'+':1,'-':1,'*':2,'/':2,'**':3,}
+    # Number of nodes in the expression (a shared node is counted once)
+    def size(self):
+        return len(postorder(self))
+
+    # Common subexpression elimination: returns the expression as a DAG in which structurally identical
+    # subtrees (same classes, operators, values and names) are one shared node, and the number of nodes
+    # that were eliminated, e.g. Expression.fromString('x*y+x*y').cse() -> a DAG with one shared node x*y, and 3
+    # (the second x*y and its leaves)
+    # All evaluators (evaluate, compile, evaluate_array, gradient, to_bytecode, diff, ...) visit a shared node
+    # once, so its value is computed only once per evaluation
+    # Note: subtrees that are only equal up to commutativity or associativity (e.g. x*y and y*x) are not merged
+    def cse(self):
+        dag=Interner().intern(self)
+        return dag,self.size()-dag.size()
+
+    # A negated variable '-x' counts as the variable 'x'
+    def variables(self):
+        names=set()
+        for node in postorder(self):
+            if isinstance(node,Variable):
+                names.add(node.char.lstrip('-'))
+            elif isinstance(node,Function):
+                names.add(node.varchar.lstrip('-'))
+        return sorted(names)
+
+    #---Compilation to a Python function----------------------------------------
+    
+    # Turns the expression into a Python function that returns a float
+    # The arguments are the variables (in the order of variables()), given positionally or by keyword:
+    # e.g. f=Expression.fromString('(2+x)*y').compile(); f(1,2)==f(x=1,y=2)==6.0
+    # The function is generated as Python source with one assignment per node, which is compiled once
+    # The source and the argument names are stored as f.source and f.variables
+    def compile(self):
+        names=self.variables()
+        for name in names:
+            if not name.isidentifier() or keyword.iskeyword(name) or name.startswith('__'):
+                raise ValueError('Cannot compile variable name: %s' % name)
         
-        for token in tokens:
-            
-            # Numbers go directly to the output
-            if isnumber(token):
-                if isint(token):
-                    output.append(Constant(int(token)))
-                else:
-                    output.append(Constant(float(token)))
-                    
-            # Operators will be compared (+,- < *,/ < **)
-            elif token in oplist:
-                while True:
-                    # Pushes operator (and break from loop) if:
-                    # Stack is empty
-                    # Operator has higher precedence than top operator in stack
-                    if stack==[] or Prec[stack[-1]]<Prec[token]:
-                        break
-                    # If Prec(stack[-1])>=Prec(token) we pop stack to output and go back to while-loop
-                    output.append(stack.pop())
-                stack.append(token)
-
-            # Left parenthesis is added to top of the stack    
-            elif token == '(':
-                stack.append(token)
-                
-            # Right parenthesis:
-            elif token == ')':
-                # Pops everything to output until left parenthesis
-                while not stack[-1] == '(':
-                    output.append(stack.pop())
-                # Removes left parenthesis '('
-                stack.pop()
+        # Functions and non-literal constants used by the generated source
+        namespace={'__float':float}
+        lines=[]
+        # Source of each node: a literal, an argument or a temporary variable
+        code={}
+        for node in postorder(self):
+            if isinstance(node,BinaryNode):
+                temp='__t%d' % len(lines)
+                lines.append('    %s = %s %s %s' % (temp,code[id(node.lhs)],node.op_symbol,code[id(node.rhs)]))
+                code[id(node)]=temp
+            elif isinstance(node,(int,float)):
+                code[id(node)]=Constant(node).pysource(namespace)
+            else:
+                code[id(node)]=node.pysource(namespace)
                 
-            # We might find an unknown token:
+        source='def compiled(%s):\n%s\n    return __float(%s)\n' % (', '.join(names),'\n'.join(lines),code[id(self)])
+        exec(compile(source,'<compiled expression>','exec'),namespace)
+        function=namespace['compiled']
+        function.source=source
+        function.variables=names
+        return function
+
+    # Translates the expression to bytecode for a small stack machine (see the class Bytecode), e.g.
+    # code=Expression.fromString('(2+x)*y').to_bytecode(); code.run({'x':1,'y':2})==6.0
+    def to_bytecode(self):
+        return Bytecode.fromExpression(self)
+
+    #---END Compilation to a Python function------------------------------------
+
+    #---Vectorized evaluation---------------------------------------------------
+
+    # Evaluates the expression for whole NumPy arrays at once
+    # env maps the names of the variables to arrays (or numbers), all arrays should have broadcastable shapes
+    # Returns one array, computed with one NumPy ufunc per node (so the tree is walked only once)
+    # e.g. Expression.fromString('2*x+y').evaluate_array({'x':np.arange(3),'y':1}) -> array([1.,3.,5.])
+    def evaluate_array(self,env):
+        if np is None:
+            raise ImportError('evaluate_array needs NumPy')
+        ufuncs={'+':np.add,'-':np.subtract,'*':np.multiply,'/':np.divide,'**':np.power}
+        values={}
+        for node in postorder(self):
+            if isinstance(node,BinaryNode):
+                values[id(node)]=ufuncs[node.op_symbol](values[id(node.lhs)],values[id(node.rhs)])
+            elif isinstance(node,(int,float)):
+                values[id(node)]=np.float64(node)
             else:
-                raise ValueError('Unknown token: %s' % token)
-            
-        # Pops any tokens still on the stack to the output
-        while len(stack) > 0:
-            output.append(stack.pop())
+                values[id(node)]=node.leaf_array(env)
+        return np.asarray(values[id(self)])
+
+    #---END Vectorized evaluation-----------------------------------------------
+
+    # The n-th derivative to var, e.g. Expression.fromString('x**3').derivative('x',2) -> 6 * x
+    # Every derivative is simplified before it is differentiated again (unless simplify is False),
+    # this keeps the trees small and the cached derivatives of unchanged subtrees are reused
+    def derivative(self,var,n=1,simplify=True):
+        expr=self.simplify() if simplify else self
+        for i in range(n):
+            expr=expr.diff(var)
+            if simplify:
+                expr=expr.simplify()
+        return expr
+
+    #---Automatic differentiation (reverse mode)--------------------------------
+
+    # Returns the value of the expression in point and the partial derivatives to all its variables, e.g.
+    # Expression.fromString('x*y+sin(x)').gradient({'x':0,'y':2}) -> (0.0, {'x':3.0,'y':0.0})
+    # One forward sweep computes the value of every node, one backward sweep (from the root to the leaves)
+    # computes the derivative of the result to every node (its adjoint) with the chain rule
+    def gradient(self,point):
+        return self.reversemode(point,False)
+
+    # The same as gradient, for NumPy arrays of values (see evaluate_array)
+    # Returns the array of values and, for every variable, the array of partial derivatives in each point
+    # Note: for a sum over all points (e.g. a misfit) the partial derivatives should be summed as well
+    def gradient_array(self,env):
+        if np is None:
+            raise ImportError('gradient_array needs NumPy')
+        with np.errstate(divide='ignore',invalid='ignore'):
+            return self.reversemode(env,True)
+
+    # Implementation of gradient and gradient_array (array is True for NumPy arrays)
+    def reversemode(self,point,array):
+        nodes=postorder(self)
+        log=np.log if array else lambda x: math.log(x) if x>0 else math.nan
+        # For numbers, 0 to a negative power is inf (as for NumPy arrays) instead of a ZeroDivisionError
+        def power(x,y):
+            try:
+                return x**y
+            except ZeroDivisionError:
+                return math.inf
         
-        # Converts RPN to an actual expression tree
-        for t in output:
-            if t in oplist:
-                # Lets eval and operator overloading take care of figuring out what to do
-                y = stack.pop()
-                x = stack.pop()
-                stack.append(eval('x %s y' % t))
+        # Forward sweep: values of all nodes, and whether they depend on a variable
+        values={}
+        depends={}
+        leaves={}
+        for node in nodes:
+            if isinstance(node,BinaryNode):
+                values[id(node)]=Operators[node.op_symbol](values[id(node.lhs)],values[id(node.rhs)])
+                depends[id(node)]=depends[id(node.lhs)] or depends[id(node.rhs)]
+            elif isinstance(node,(int,float)):
+                values[id(node)]=float(node)
+                depends[id(node)]=False
             else:
-                # a constant, push it to the stack
-                stack.append(t)
-                
-        # The resulting expression tree is what's left on the stack
-        return stack[0]
+                value,name,partial=node.leafgradient(point,array)
+                values[id(node)]=value
+                depends[id(node)]=name is not None
+                if name is not None:
+                    leaves[id(node)]=(name,partial)
+                    
+        # Backward sweep: adjoints of all nodes that depend on a variable, parents before children
+        result=values[id(self)]
+        adjoints={id(self):np.ones_like(result) if array else 1.0}
+        gradient={}
+        for node in reversed(nodes):
+            if not depends[id(node)]:
+                continue
+            adjoint=adjoints.pop(id(node))
+            if isinstance(node,BinaryNode):
+                l=values[id(node.lhs)]
+                r=values[id(node.rhs)]
+                # Partial derivatives of the node to its children
+                if node.op_symbol=='+':
+                    dl,dr=1,1
+                elif node.op_symbol=='-':
+                    dl,dr=1,-1
+                elif node.op_symbol=='*':
+                    dl,dr=r,l
+                elif node.op_symbol=='/':
+                    dl,dr=1/r,-values[id(node)]/r
+                elif node.op_symbol=='**':
+                    dl=r*power(l,r-1) if depends[id(node.lhs)] else 0
+                    dr=values[id(node)]*log(l) if depends[id(node.rhs)] else 0
+                for child,partial in [(node.lhs,dl),(node.rhs,dr)]:
+                    if depends[id(child)]:
+                        if id(child) in adjoints:
+                            adjoints[id(child)]=adjoints[id(child)]+adjoint*partial
+                        else:
+                            adjoints[id(child)]=adjoint*partial
+            else:
+                name,partial=leaves[id(node)]
+                if name in gradient:
+                    gradient[name]=gradient[name]+adjoint*partial
+                else:
+                    gradient[name]=adjoint*partial
+        return result,gradient
+
+    #---END Automatic differentiation-------------------------------------------
+
+    # Returns a smaller, equivalent tree (see simplifyPass), the passes are repeated until nothing changes
+    # e.g. (x*1+0)*x+x*x -> 2 * x ** 2
+    def simplify(self):
+        expr=self
+        for i in range(100):
+            new=simplifyPass(expr)
+            if new is expr or (new.size()==expr.size() and new==expr):
+                return new
+            expr=new
+        return expr
+
+    # Partial evaluation: the variables in bindings (and the functions of them) are replaced by their values,
+    # and the result is simplified, e.g. Expression.fromString('a*x+b*x**2').specialize({'a':2,'b':0}) -> 2 * x
+    # The bound leaves are replaced and all constants are folded in one pass over the tree (see simplifyPass),
+    # only the (smaller) residual is simplified further, so it can be compiled once for the free variables:
+    # f=expr.specialize(bindings).compile(); f(...) for many values of the free variables
+    def specialize(self,bindings):
+        return simplifyPass(self,lambda node: bindLeaf(node,bindings)).simplify()
+
+    #---Parser-----------------------------------------------------------------
     
-    #---END Shunting-yard algorithm---------------------------------------------------------------
+    # Builds an expression tree from a string, e.g. Expression.fromString('-x**2 + 2*sin(y)')
+    # Understands numbers, variables, the basic functions sin, cos and log of a variable,
+    # the operators + - * / ** (with unary minus) and parentheses
+    # Uses operator-precedence parsing with explicit stacks, see parseExpression
+    # Results are kept in the LRU cache ParseCache.default, so parsing the same string again returns
+    # the same (shared) tree: such trees should not be changed
+    def fromString(string):
+        return ParseCache.default.parse(string)
+    
+    #---END Parser-------------------------------------------------------------
 
 #---END Class: Expression----------------------------------------------------------------------------
 
@@ -169,15 +726,25 @@ class Expression():
 # Represents a constant (numerical or non-numerical value)
 class Constant(Expression):
 
+    __slots__=('value',)
+
     # Constants can be numerical or non-numerical
     def __init__(self, value): 
-        if isnumber(value):
+        # Fast path: Python integers that are exactly representable as float stay the same
+        if type(value) is int and -2**53<=value<=2**53:
+            pass
+        elif isnumber(value):
             if isint(value):
-                self.value = int(float(value))
+                value = int(float(value))
             else:
-                self.value = float(value)
+                value = float(value)
         else:
-            self.value = str(value)
+            value = str(value)
+        setattribute(self,'value',value)
+
+    # Pickling and copying: a node is rebuilt with its constructor
+    def __reduce__(self):
+        return (Constant,(self.value,))
 
     # Overload: Equality ==
     def __eq__(self, other):
@@ -186,6 +753,17 @@ class Constant(Expression):
         else:
             return False
 
+    # Overload: Hash, consistent with ==
+    def __hash__(self):
+        return hash(('Constant',self.value))
+
+    # Canonical form, see BinaryNode.canonical
+    def canonical(self):
+        if isnumber(self.value):
+            return ('Constant',0,self.value)
+        else:
+            return ('Constant',1,self.value)
+
     # Overload: String str
     def __str__(self):
         return str(self.value)
@@ -213,6 +791,31 @@ class Constant(Expression):
     # Derivative
     def diff(self,var):
         return Constant(0)
+
+    # Python source for compile(), only numerical constants can be compiled
+    def pysource(self,namespace):
+        if not isnumber(self.value):
+            raise ValueError('Cannot compile non-numerical constant: %s' % self.value)
+        # Literals such as inf and nan are not valid Python, these are looked up in the namespace
+        if math.isfinite(self.value):
+            return '(%r)' % self.value
+        name='__c%d' % len(namespace)
+        namespace[name]=self.value
+        return name
+
+    # Value for evaluate_array
+    def leaf_array(self,env):
+        if not isnumber(self.value):
+            raise ValueError('Cannot evaluate non-numerical constant: %s' % self.value)
+        return np.float64(self.value)
+
+    # Value, variable and partial derivative for gradient (a constant does not depend on a variable)
+    def leafgradient(self,point,array):
+        if array:
+            return self.leaf_array(point),None,None
+        if not isnumber(self.value):
+            raise ValueError('Cannot evaluate non-numerical constant: %s' % self.value)
+        return float(self.value),None,None
     
     # Evaluate
     def evaluate(self,Dic={}):
@@ -225,9 +828,14 @@ class Constant(Expression):
 
 # Represents a variable
 class Variable(Expression):
+
+    __slots__=('char',)
     
     def __init__(self, character):
-        self.char=str(character)
+        setattribute(self,'char',str(character))
+
+    def __reduce__(self):
+        return (Variable,(self.char,))
         
     def __str__(self):
         return self.char
@@ -238,6 +846,13 @@ class Variable(Expression):
         else:
             return False
 
+    def __hash__(self):
+        return hash(('Variable',self.char))
+
+    # Canonical form, see BinaryNode.canonical
+    def canonical(self):
+        return ('Variable',self.char)
+
     # Overload: Negation
     def __neg__(self):
         if self.char[0] == '-':
@@ -254,12 +869,42 @@ class Variable(Expression):
         else:
             return Constant(0)
 
+    # Python source for compile()
+    def pysource(self,namespace):
+        if self.char[0]=='-':
+            return '(-%s)' % self.char[1:]
+        return self.char
+
+    # Value for evaluate_array
+    def leaf_array(self,env):
+        if self.char in env:
+            return np.asarray(env[self.char],dtype=np.float64)
+        elif (-self).char in env:
+            return np.negative(np.asarray(env[(-self).char],dtype=np.float64))
+        else:
+            raise ValueError('No value for variable: %s' % self.char)
+
+    # Value, variable and partial derivative for gradient
+    # Note: the variable '-x' has partial derivative -1 to x
+    def leafgradient(self,point,array):
+        if array:
+            value=self.leaf_array(point)
+        elif self.char in point:
+            value=float(point[self.char])
+        elif (-self).char in point:
+            value=-float(point[(-self).char])
+        else:
+            raise ValueError('No value for variable: %s' % self.char)
+        if self.char in point:
+            return value,self.char,1.0
+        return value,(-self).char,-1.0
+
     # Evaluate
     def evaluate(self,Dic={}):
         if self.char in Dic:
             return Constant(Dic[self.char])
         elif (-self).char in Dic:
-            return Constant(-Dic[self.char])
+            return Constant(-Dic[(-self).char])
         else:
             return self
 #---END Subclass: Variable---------------------------------------------
@@ -271,16 +916,31 @@ class Variable(Expression):
 # Note: at the moment we cannot deal with function composition (functions are leaves)
 # Note: at the moment we cannot deal with multiple variable
 class Function(Expression):
+
+    __slots__=('funchar','varchar')
     
     def __init__(self, funcharacter, varcharacter):
-        self.funchar=str(funcharacter)
-        self.varchar=str(varcharacter)
+        setattribute(self,'funchar',str(funcharacter))
+        setattribute(self,'varchar',str(varcharacter))
+
+    def __reduce__(self):
+        return (type(self),(self.funchar,self.varchar))
         
     def __str__(self):
         return self.funchar+'('+self.varchar+')'
 
     def __eq__(self,other):
-        return self.funchar==other.funchar and self.varchar==other.varchar
+        if isinstance(other, Function):
+            return self.funchar==other.funchar and self.varchar==other.varchar
+        else:
+            return False
+
+    def __hash__(self):
+        return hash(('Function',self.funchar,self.varchar))
+
+    # Canonical form, see BinaryNode.canonical
+    def canonical(self):
+        return ('Function',self.funchar,self.varchar)
     
 #---END Subclass: Function-------------------------------------------------
 
@@ -289,12 +949,14 @@ class Function(Expression):
 class Basic(Function):
     # Represents a standard function of 1 variable (sin,cos,log or negations)
 
+    __slots__=()
+
     # Overload: Negation (-)
     def __neg__(self):
-        if self.char[0] == '-':
-            return Variable(self.char[1:])
+        if self.funchar[0] == '-':
+            return Basic(self.funchar[1:],self.varchar)
         else:
-            return Variable('-'+self.char)
+            return Basic('-'+self.funchar,self.varchar)
 
     # Derivative of basic functions
     def diff(self,variable):
@@ -316,6 +978,39 @@ class Basic(Function):
         else:
             return Constant(0)
 
+    # Python source for compile()
+    def pysource(self,namespace):
+        name=self.funchar.lstrip('-')
+        if name not in Functions:
+            raise ValueError('Cannot compile unknown function: %s' % self.funchar)
+        namespace['__'+name]=Functions[name]
+        source='__%s(%s)' % (name,Variable(self.varchar).pysource(namespace))
+        if self.funchar[0]=='-':
+            return '(-%s)' % source
+        return source
+
+    # Value for evaluate_array
+    def leaf_array(self,env):
+        ufuncs={'sin':np.sin,'cos':np.cos,'log':np.log}
+        name=self.funchar.lstrip('-')
+        if name not in ufuncs:
+            raise ValueError('Cannot evaluate unknown function: %s' % self.funchar)
+        value=ufuncs[name](Variable(self.varchar).leaf_array(env))
+        if self.funchar[0]=='-':
+            return np.negative(value)
+        return value
+
+    # Value, variable and partial derivative for gradient
+    def leafgradient(self,point,array):
+        lib=np if array else math
+        functions={'sin':(lib.sin,lib.cos),'cos':(lib.cos,lambda x: -lib.sin(x)),'log':(lib.log,lambda x: 1/x)}
+        name=self.funchar.lstrip('-')
+        if name not in functions:
+            raise ValueError('Cannot evaluate unknown function: %s' % self.funchar)
+        x,var,partial=Variable(self.varchar).leafgradient(point,array)
+        sign=-1 if self.funchar[0]=='-' else 1
+        return sign*functions[name][0](x),var,sign*partial*functions[name][1](x)
+
     # Evaluaton of basic functions
     def evaluate(self,Dic={}):
         if self.varchar in Dic:
@@ -344,191 +1039,228 @@ class Basic(Function):
 
 # Represents a binary tree, where each internal node represents an operation        
 class BinaryNode(Expression):
-    
-    def __init__(self, lhs, rhs, op_symbol):
-        self.lhs = lhs
-        self.rhs = rhs
-        self.op_symbol = op_symbol
 
-    #---Overload: Equality (==) -------------------------------------------------------------------
-        
-    # Uses recursion on children of nodes
+    __slots__=('lhs','rhs','canon','hashcache','diffcache')
+    # The caches for canonical(), __hash__ and diff, the only attributes that can be set after __init__
+    Caches=('canon','hashcache','diffcache')
+    # The operator is an attribute of the subclasses (e.g. AddNode.op_symbol=='+')
+    op_symbol=None
     
-    def __eq__(self, other):
-        if type(self) == type(other):
-            
-            # Checks equality of AddNodes and MultiplyNodes (commutativity and assiociativity)
-            if self.op_symbol in ['+','*']:
-                
-                # Checks if: (a+b)+(c+d)=(x+y)+(z+p) or '*' instead of '+'
-                if isinstance(self.lhs,BinaryNode) and isinstance(self.rhs,BinaryNode) and\
-                   isinstance(other.lhs,BinaryNode) and isinstance(other.rhs,BinaryNode) and\
-                   self.op_symbol==self.lhs.op_symbol and\
-                   self.op_symbol==self.rhs.op_symbol and\
-                   self.op_symbol==other.lhs.op_symbol and\
-                   self.op_symbol==other.rhs.op_symbol:
-                    # We check the cases respectively: (a+b),(c+d)=
-                    # (x+y),(z+p); (z+p),(x+y); (x+z),(y+p); (y+p),(x+z); (x+p),(y+z); (y+z),(x+p)
-                    return (self.lhs == other.lhs and self.rhs == other.rhs) or\
-                           (self.lhs == other.rhs and self.rhs == other.lhs) or\
-                           (self.lhs == type(self)(other.lhs.lhs,other.rhs.lhs) and\
-                            self.rhs == type(self)(other.lhs.rhs,other.rhs.rhs)) or\
-                           (self.lhs == type(self)(other.lhs.rhs,other.rhs.rhs) and\
-                            self.rhs == type(self)(other.lhs.lhs,other.rhs.lhs)) or\
-                           (self.lhs == type(self)(other.lhs.lhs,other.rhs.rhs) and\
-                            self.rhs == type(self)(other.lhs.rhs,other.rhs.lhs)) or\
-                           (self.lhs == type(self)(other.lhs.rhs,other.rhs.lhs) and\
-                            self.rhs == type(self)(other.lhs.lhs,other.rhs.rhs))
-                
-                # Checks if: (a+b)+c=(x+y)+z, where c and z are not AddNodes (also '*' instead of '+')
-                elif isinstance(self.lhs,BinaryNode) and isinstance(other.lhs,BinaryNode) and\
-                     self.op_symbol==self.lhs.op_symbol and\
-                     self.op_symbol==other.lhs.op_symbol:
-                    # Checks the cases respectively: (a+b),c=
-                    # (x+y),z; (x+z),y; (y+z),x
-                    return (self.lhs == other.lhs and self.rhs == other.rhs) or\
-                           (self.lhs == type(self)(other.lhs.lhs,other.rhs) and\
-                           self.rhs == other.lhs.rhs) or\
-                           (self.lhs == type(self)(other.lhs.rhs.other.rhs) and\
-                           self.rhs == other.lhs.lhs)
-
-                # Checks if: a+(b+c)=x+(y+z): 
-                elif isinstance(self.rhs,BinaryNode) and isinstance(other.rhs,BinaryNode) and\
-                     self.op_symbol==self.rhs.op_symbol and\
-                     self.op_symbol==other.rhs.op_symbol:
-                    # Checks the cases respectively: a,(b+c)=
-                    # x,(y+z); z,(y+x); y,(z+x)
-                    return (self.lhs == other.lhs and self.rhs == other.rhs) or\
-                           (self.rhs == type(self)(other.rhs.lhs,other.lhs) and\
-                           self.lhs == other.rhs.rhs) or\
-                           (self.rhs == type(self)(other.rhs.rhs,other.lhs) and\
-                           self.lhs == other.rhs.lhs)
-                
-                # Checks if: (a+b)+c=x+(y+z): 
-                elif isinstance(self.lhs,BinaryNode) and isinstance(other.rhs,BinaryNode) and\
-                     self.op_symbol==self.lhs.op_symbol and\
-                     self.op_symbol==other.rhs.op_symbol:
-                    # Checks the cases respectively: (a+b),c=
-                    # (y+z),x; (y+x),z; (z+x),y
-                    return (self.lhs == other.rhs and self.rhs == other.lhs) or\
-                           (self.lhs == type(self)(other.rhs.lhs,other.lhs) and\
-                           self.rhs == other.rhs.rhs) or\
-                           (self.lhs == type(self)(other.rhs.rhs,other.lhs) and\
-                           self.rhs == other.rhs.lhs)
-
-                # Checks if: a+(b+c)=(x+y)+z:
-                elif isinstance(self.rhs,BinaryNode) and isinstance(other.lhs,BinaryNode) and\
-                     self.op_symbol==self.rhs.op_symbol and\
-                     self.op_symbol==other.lhs.op_symbol:
-                    # Checks the cases respectively: a,(b+c)=
-                    # z,(x+y); y,(x+z); x,(y+z)
-                    return (self.lhs == other.rhs and self.rhs == other.lhs) or\
-                           (self.rhs == type(self)(other.lhs.lhs,other.rhs) and\
-                           self.lhs == other.lhs.rhs) or\
-                           (self.rhs == type(self)(other.lhs.rhs,other.rhs) and\
-                           self.lhs == other.lhs.lhs)
-                
-                # Checks if: a+b=x+y
+    # The children should be expressions or numbers (see childnumber)
+    # BinaryNode(lhs,rhs,op_symbol) makes a node of the subclass of the operator, e.g. BinaryNode(x,y,'+') is AddNode(x,y)
+    def __init__(self, lhs, rhs, op_symbol=None):
+        if type(self) is BinaryNode:
+            if op_symbol not in NodeTypes:
+                raise TypeError('Unknown operator for BinaryNode: %s' % op_symbol)
+            setattribute(self,'__class__',NodeTypes[op_symbol])
+        elif op_symbol is not None and op_symbol!=self.op_symbol:
+            raise TypeError('Operator of %s should be %s, not %s' % (type(self).__name__,self.op_symbol,op_symbol))
+        if not isinstance(lhs,Expression):
+            lhs=childnumber(lhs,self)
+        if not isinstance(rhs,Expression):
+            rhs=childnumber(rhs,self)
+        # (see the setters below the class)
+        setLhs(self,lhs)
+        setRhs(self,rhs)
+        setCanon(self,None)
+        setHashcache(self,None)
+        # The dictionary for diff is only made when it is needed
+        setDiffcache(self,None)
+
+    # Overload: attribute assignment, only the caches can be filled in
+    def __setattr__(self,name,value):
+        if name in BinaryNode.Caches:
+            setattribute(self,name,value)
+        else:
+            Expression.__setattr__(self,name,value)
+
+    # Pickling and copying: a node is rebuilt with its constructor (the caches are not copied)
+    def __reduce__(self):
+        return (type(self),(self.lhs,self.rhs))
+
+    #---Canonical form-----------------------------------------------------------------------------
+
+    # The canonical form is a nested tuple which is the same for trees that are equal up to
+    # commutativity and associativity of '+' and '*': a chain like a+(b+c) is flattened to one
+    # operation with the operands [a,b,c], and these operands are sorted (see sortcanonical)
+    # It is computed without recursion, and cached on every BinaryNode it visits
+
+    def canonical(self):
+        if self.canon is None:
+            operands={}
+            stack=[(self,False)]
+            while stack:
+                node,expanded=stack.pop()
+                if node.canon is not None:
+                    continue
+                if expanded:
+                    children=operands.pop(id(node))
+                    keys=[canonical(child) for child in children]
+                    if node.op_symbol in ['+','*']:
+                        node.canon=(node.op_symbol,sortcanonical([hashof(child) for child in children],keys))
+                    else:
+                        node.canon=(node.op_symbol,keys[0],keys[1])
                 else:
-                    # We check the cases a,b=x,y and a,b=y,x
-                    return (self.lhs == other.lhs and self.rhs == other.rhs) or\
-                           (self.lhs == other.rhs and self.rhs == other.lhs)
-                
-            # Checks the other operators '-','/','**' (non-commutative and non-associative)
+                    operands[id(node)]=node.operands()
+                    stack.append((node,True))
+                    for child in operands[id(node)]:
+                        if isinstance(child,BinaryNode) and child.canon is None:
+                            stack.append((child,False))
+        return self.canon
+
+    # The operands of this node: for '+' and '*' all operands of the chain of equal operators, else lhs and rhs
+    def operands(self):
+        if self.op_symbol not in ['+','*']:
+            return [self.lhs,self.rhs]
+        result=[]
+        stack=[self.rhs,self.lhs]
+        while stack:
+            node=stack.pop()
+            if type(node)==type(self):
+                stack.append(node.rhs)
+                stack.append(node.lhs)
             else:
-                return self.lhs == other.lhs and self.rhs == other.rhs
-            
-        # If NodeTypes are not the same, then the expressions are not equal
+                result.append(node)
+        return result
+    
+    #---END Canonical form-------------------------------------------------------------------------
+
+
+    #---Overload: Equality (==) and Hash-----------------------------------------------------------
+
+    # Two trees are equal if they have the same canonical form (this takes into account commutativity
+    # and associativity of '+' and '*' at any depth), which is a linear-time comparison
+    # Equal trees have equal hashes (and the hash is cached), so expressions can be used as dictionary keys
+    
+    def __eq__(self, other):
+        # The same object (e.g. an interned node) is always equal to itself
+        if self is other:
+            return True
+        if isinstance(other,BinaryNode):
+            # Trees with different (cached) hashes are never equal
+            if hash(self)!=hash(other):
+                return False
+            return samecanonical(self.canonical(),other.canonical())
         else:
             return False
-        
-    #---END Overload: Equality ==----------------------------------------------------------------
+
+    # The hash is computed from the (cached) hashes of the operands in the canonical form,
+    # in the same way as canonical() without recursion
+    def __hash__(self):
+        if self.hashcache is None:
+            operands={}
+            stack=[(self,False)]
+            while stack:
+                node,expanded=stack.pop()
+                if node.hashcache is not None:
+                    continue
+                if expanded:
+                    hashes=[hashof(child) for child in operands.pop(id(node))]
+                    if node.op_symbol in ['+','*']:
+                        node.hashcache=hash((node.op_symbol,tuple(sorted(hashes))))
+                    else:
+                        node.hashcache=hash((node.op_symbol,hashes[0],hashes[1]))
+                else:
+                    operands[id(node)]=node.operands()
+                    stack.append((node,True))
+                    for child in operands[id(node)]:
+                        if isinstance(child,BinaryNode) and child.hashcache is None:
+                            stack.append((child,False))
+        return self.hashcache
+
+    #---END Overload: Equality (==) and Hash-------------------------------------------------------
 
 
     #---Overload: String str-------------------------------------------------------------------
         
-    # Uses recursion on children of nodes
+    # The nodes are visited once in postorder: every node decides on simplifications and brackets
+    # from the types of its children and the Renderings (strings) of its children (see render),
+    # the resulting pieces are joined into one string at the end
 
     def __str__(self):
-        LS=str(self.lhs)
-        RS=str(self.rhs)
-        Left=''
-        Right=''
+        renderings={}
+        for node in postorder(self):
+            if isinstance(node,BinaryNode):
+                renderings[id(node)]=node.render(renderings[id(node.lhs)],renderings[id(node.rhs)])
+            else:
+                renderings[id(node)]=Rendering(str(node))
+        return renderings[id(self)].tostring()
+
+    # Rendering of this node, given the Renderings LS and RS of the children
+    def render(self,LS,RS):
         Prec={'+':1,'-':1,'*':2,'/':2,'**':3,}
-        oplist = ['+','-','*','/','**']
         
         # Part 1: simplify situations where children stringify to 0, 1 or -1
         # Case: both children stringify to '0' or '0.0'
         # Note: we ignore difficulties with 0/0 and 0**0
-        if isint(LS) and isint(RS) and\
-           int(float(str(self.lhs)))==0 and int(float(str(self.rhs)))==0:
+        if LS.isint() and RS.isint() and LS.intvalue()==0 and RS.intvalue()==0:
             # Returns '0'
-            return str(0)
+            return Rendering('0')
 
         # Case: only left child stringifies to '0' or '0.0'
-        if isint(LS) and int(float(LS))==0:
+        if LS.isint() and LS.intvalue()==0:
             # Subcase: 0+a -> a
             if self.op_symbol=='+':
-                return RS         
+                return RS
             # Subcase: 0*a,0/a,0**a -> 0
-            elif self.op_symbol in ['*','/','**']: # 0*a=0/a=0**a=0
-                return str(0)            
+            elif self.op_symbol in ['*','/','**']:
+                return Rendering('0')
             # Subcase: 0-a -> -a
-            elif self.op_symbol=='-':                
+            elif self.op_symbol=='-':
                 # Subsubcase: a is not a BinaryNode (constant,variable or function)
                 if not isinstance(self.rhs,BinaryNode):
-                    return str(-self.rhs)                
+                    return Rendering(str(-self.rhs))
                 # Subsubcase: a is BinaryNode
                 else:
                     # Subsubsubcase: a stringifies to expression
-                    if isexp(RS):
-                        return '-'+'('+RS+')'
+                    if RS.isexp():
+                        return Rendering.concat('-(',RS,')')
                     # Subsubsubcase: a does not stringifies to expression
                     else:
-                        if RS[0]=='-':
-                            return RS[1:]
+                        if RS.first()=='-':
+                            return RS.strip()
                         else:
-                            return '-'+RS
+                            return Rendering.concat('-',RS)
 
         # Case: only right child stringifies to '0' or '0.0'
-        if isint(RS) and int(float(RS))==0:
+        if RS.isint() and RS.intvalue()==0:
             # Subcase: a+0,a-0 -> a
             if self.op_symbol in ['+','-']:
                 return LS
             # Subcase: a*0 -> 0
             elif self.op_symbol=='*':
-                return str(0)
+                return Rendering('0')
             # Subcase: a**0 -> 1
             elif self.op_symbol=='**':
-                return str(1)
+                return Rendering('1')
 
         # Case: left child stringifies to '1' or '1.0'
-        if isint(LS) and int(float(LS))==1:
+        if LS.isint() and LS.intvalue()==1:
             # Subcase: 1*a -> a
-            if self.op_symbol=='*': 
+            if self.op_symbol=='*':
                 return RS
             # Subcase: 1**a -> 1
-            elif self.op_symbol=='**': 
-                return str(1)
+            elif self.op_symbol=='**':
+                return Rendering('1')
 
-        # Case: (only) right child stringifies to '1' or '1.0'       
-        if isint(RS) and int(float(RS))==1:
+        # Case: (only) right child stringifies to '1' or '1.0'
+        if RS.isint() and RS.intvalue()==1:
             # Subcase: a*1,a/1,a**1 -> a (only subcase)
             if self.op_symbol in ['*','/','**']:
                 return LS
             
         # Case: left child stringifies to '-1' or '-1.0'
-        if isint(LS) and int(float(LS))==-1:
+        if LS.isint() and LS.intvalue()==-1:
             # Subcase: (-1)*a -> -a (only subcase)
             # Note: if a is BinaryNode, then (-1)*a -> -a -> 0-a, which is dealt with above
             if self.op_symbol=='*':
-                return(str(-self.lhs))
+                return negated(self.lhs,LS)
             
-        # Case: (only) right child stringifies to '-1' or '-1.0'   
-        if isint(RS) and int(float(RS))==-1:
+        # Case: (only) right child stringifies to '-1' or '-1.0'
+        if RS.isint() and RS.intvalue()==-1:
             # Subcase: a*(-1),a/(-1) -> -a
             if self.op_symbol in ['*','/']:
-                return(str(-self.rhs))
+                return negated(self.rhs,RS)
 
         # Part 2: after dealing with 0,1,-1 we deal with brackets
         # We deal with left and right child seperately
@@ -539,34 +1271,34 @@ class BinaryNode(Expression):
             #Subcase: child operator has lower precedence than parent operator
             if Prec[self.lhs.op_symbol]<Prec[self.op_symbol]:
                 #Subsubcase: child stringifies to expression
-                if isexp(LS):
-                    Left='('+LS+')'
+                if LS.isexp():
+                    Left=Rendering.concat('(',LS,')')
                 #Subsubcase: child stringifies to number, constant or variable
                 else:
-                    Left=LS                    
+                    Left=LS
             # Subcase: both operators are '**'
             elif self.op_symbol=='**' and self.lhs.op_symbol=='**':
-                Left='('+LS+')'
+                Left=Rendering.concat('(',LS,')')
             #Subcase: child operator has higher or equal precedence than parent operator (not both '**')
             else:
                 Left=LS
 
         # Left child case: child is not a BinaryNode
-        else: 
+        else:
             Left=LS
 
         # Right child case: child is a BinaryNode
         if isinstance(self.rhs,BinaryNode):
             # Subcase: child stringifies to expression
-            if isexp(RS):                
+            if RS.isexp():
                 # Subssubcase: child operator has lower or equal precedence than parent operator
                 if Prec[self.rhs.op_symbol]<Prec[self.op_symbol]:
-                    Right='('+RS+')'
+                    Right=Rendering.concat('(',RS,')')
                 # Subsubcase: child operator has equal precedence as parent operator
                 elif Prec[self.rhs.op_symbol]==Prec[self.op_symbol]:
                     # Subsubsubcase: operator is '-', '/', '**'
                     if self.op_symbol in ['-','/','**']:
-                        Right='('+RS+')'
+                        Right=Rendering.concat('(',RS,')')
                     # Subsubsubcase: operator is '+','*'
                     else:
                         Right=RS
@@ -576,57 +1308,76 @@ class BinaryNode(Expression):
             # Subcase: child stringifies to number, constant or variable
             else:
                 # Subsubcase: child stringifies to "positive" number, constant or variable
-                if ispos(RS):
+                if RS.ispos():
                     Right=RS
                 # Subsubcase: child stringifies to "negative" number, constant or variable
                 else:
-                    Right='('+RS+')'
+                    Right=Rendering.concat('(',RS,')')
 
         # Right child case: child is not a BinaryNode
         else:
             # Subcase: child is not positive and operator is '-' or '/'
             if not ispos(self.rhs) and self.op_symbol in ['+','-']:
-                Right='('+str(self.rhs)+')'
+                Right=Rendering.concat('(',RS,')')
             # Subcase: other cases
             else:
-                Right=str(self.rhs)
+                Right=RS
 
         # Put all parts together
-        return Left+' '+self.op_symbol+' '+Right
+        return Rendering.concat(Left,' '+self.op_symbol+' ',Right)
     
         #---END Overload: String str-------------------------------------------------------------------
 
     #---Derivative of binary tree----------------------------------------------------------------------
     
-    # Uses recursion and basic differentiation rules
+    # Uses basic differentiation rules, see rule
+    # The derivative of every node is computed once (in postorder) and cached on the node per variable,
+    # so shared subtrees and subtrees that were differentiated before are not differentiated again
+    # The derivative reuses the nodes of the original tree (e.g. self.rhs in the product rule),
+    # so it forms a DAG that shares subtrees with the original tree
     # Note: at the moment we cannot deal with expressions a**x, where x is not a constant
     
-    def diff(self,var):       
-        # conversion python numbers to our classes.
-        if type(self.lhs) == int or type(self.lhs) == float:
-            self.lhs = Constant(self.lhs)
-        if type(self.rhs) == int or type(self.rhs) == float:
-            self.rhs = Constant(self.rhs)
+    def diff(self,var):
+        derivatives={}
+        notcached=lambda node: node.diffcache is None or var not in node.diffcache
+        for node in postorder(self,notcached):
+            if isinstance(node,BinaryNode) and notcached(node):
+                if node.diffcache is None:
+                    node.diffcache={}
+                node.diffcache[var]=node.rule(derivatives[id(node.lhs)],derivatives[id(node.rhs)])
+            if isinstance(node,BinaryNode):
+                derivatives[id(node)]=node.diffcache[var]
+            elif isinstance(node,(int,float)):
+                derivatives[id(node)]=Constant(0)
+            else:
+                derivatives[id(node)]=node.diff(var)
+        return derivatives[id(self)]
+
+    # Derivative of this node, given the derivatives dL and dR of its children
+    def rule(self,dL,dR):
+        # conversion python numbers to our classes (the node itself is not changed)
+        L = Constant(self.lhs) if isinstance(self.lhs,(int,float)) else self.lhs
+        R = Constant(self.rhs) if isinstance(self.rhs,(int,float)) else self.rhs
         
         # Sum rule
         if self.op_symbol == '+':
-            return self.lhs.diff(var) + self.rhs.diff(var)
+            return dL + dR
         
         # Difference rule
         if self.op_symbol == '-':
-            return self.lhs.diff(var) - self.rhs.diff(var)
+            return dL - dR
         
         # Product rule
         if self.op_symbol == '*':
-            return (self.rhs * self.lhs.diff(var) ) + (self.rhs.diff(var) * self.lhs)
+            return (R * dL) + (dR * L)
         
         # Quotient rule
         if self.op_symbol == '/':
-            return ((self.rhs * self.lhs.diff(var)) - (self.rhs.diff(var) * self.lhs)) / (self.rhs * self.rhs)
+            return ((R * dL) - (dR * L)) / (R * R)
         
         # Power rule
         if self.op_symbol == '**':
-            return (self.rhs * (self.lhs**(self.rhs - Constant(1))))  * self.lhs.diff(var)
+            return (R * (L**(R - Constant(1))))  * dL
         
     #---END Derivative of binary tree--------------------------------------------------------------------------
 
@@ -635,30 +1386,40 @@ class BinaryNode(Expression):
         
     # Evaluates the expression, values of variables are loaded through dictionary
     # Returns a new tree, where numerical constants are united where possible (e.g. 1+2->3)
-    # Uses recursion on children
+    # Every node is evaluated exactly once: the nodes are visited in postorder and
+    # the value of each node is stored, so a parent looks up the values of its children
     
     def evaluate(self,Dic={}):
-        
+        values={}
+        for node in postorder(self):
+            if isinstance(node,BinaryNode):
+                values[id(node)]=node.fold(values[id(node.lhs)],values[id(node.rhs)])
+            elif isinstance(node,(int,float)):
+                values[id(node)]=Constant(node)
+            else:
+                values[id(node)]=node.evaluate(Dic)
+        return values[id(self)]
+
+    # Combines the evaluated children L and R of this node
+    def fold(self,L,R):
         # Case: children evaluate to numerical values (allowing for basic arithmetics)
-        if isinstance(self.lhs.evaluate(Dic),Constant) and isinstance(self.rhs.evaluate(Dic),Constant):
-            if isnumber(self.lhs.evaluate(Dic).value) and isnumber(self.rhs.evaluate(Dic).value):
-                if self.op_symbol=='+':
-                    return Constant(self.lhs.evaluate(Dic).value+self.rhs.evaluate(Dic).value)
-                elif self.op_symbol=='-':
-                    return Constant(self.lhs.evaluate(Dic).value-self.rhs.evaluate(Dic).value)
-                elif self.op_symbol=='*':
-                    return Constant(self.lhs.evaluate(Dic).value*self.rhs.evaluate(Dic).value)
-                elif self.op_symbol=='/':
-                    return Constant(self.lhs.evaluate(Dic).value/self.rhs.evaluate(Dic).value)
-                elif self.op_symbol=='**':
-                    return Constant(self.lhs.evaluate(Dic).value**self.rhs.evaluate(Dic).value)
+        if isinstance(L,Constant) and isinstance(R,Constant):
+            if isnumber(L.value) and isnumber(R.value):
+                return Constant(Operators[self.op_symbol](L.value,R.value))
                 
         # Case: At least one child evaluates to tree or non-numerical constant
-        return type(self)(self.lhs.evaluate(Dic),self.rhs.evaluate(Dic))
+        return type(self)(L,R)
     
     #---END Evaluation of binary tree----------------------------------------------------------------------
 
 
+# Setters of the slots of BinaryNode for __init__, these are faster than setattribute
+setLhs=BinaryNode.lhs.__set__
+setRhs=BinaryNode.rhs.__set__
+setCanon=BinaryNode.canon.__set__
+setHashcache=BinaryNode.hashcache.__set__
+setDiffcache=BinaryNode.diffcache.__set__
+
 #---END Subclass: BinaryNode---------------------------------------------------------------------------
 
 
@@ -666,28 +1427,569 @@ class BinaryNode(Expression):
         
 class AddNode(BinaryNode):
     #Represents the addition operator
-    def __init__(self, lhs, rhs):
-        super(AddNode, self).__init__(lhs, rhs, '+')
+    __slots__=()
+    op_symbol='+'
 
 class SubtractNode(BinaryNode):
     #Represents the subtraction operator
-    def __init__(self, lhs, rhs):
-        super(SubtractNode, self).__init__(lhs, rhs, '-')
+    __slots__=()
+    op_symbol='-'
 
 class MultiplyNode(BinaryNode):
     #Represents the multiplication operator
-    def __init__(self, lhs, rhs):
-        super(MultiplyNode, self).__init__(lhs, rhs, '*')
+    __slots__=()
+    op_symbol='*'
 
 class DivideNode(BinaryNode):
     #Represents the division operator
-    def __init__(self, lhs, rhs):
-        super(DivideNode, self).__init__(lhs, rhs, '/')
+    __slots__=()
+    op_symbol='/'
 
 class PowerNode(BinaryNode):
     #Represents the exponentiation operator
-    def __init__(self, lhs, rhs):
-        super(PowerNode, self).__init__(lhs, rhs, '**')
+    __slots__=()
+    op_symbol='**'
+
+# The subclass of BinaryNode of every operator, e.g. for BinaryNode(lhs,rhs,op_symbol)
+NodeTypes={'+':AddNode,'-':SubtractNode,'*':MultiplyNode,'/':DivideNode,'**':PowerNode}
         
 #---END Subclasses if BinaryNode----------------------------------------------------------------------------
 
+
+#---Interning (hash-consing)--------------------------------------------------------------------------
+
+# Keeps one shared instance of every structurally equal node
+# Structurally equal means: same class and same value/character, or same class and the same (interned) children
+# Interning is opt-in: nodes made with the usual constructors and operators are not interned,
+# use intern(expr) to get the shared version of a whole tree, or make(cls,...) to construct a shared node
+# The table only holds weak references, so nodes that are no longer used elsewhere are removed from it
+# e.g. table=Interner(); table.intern(x*y+x*y) has only one node x*y, and table.intern(x*y) is that node
+class Interner():
+
+    def __init__(self):
+        self.table=weakref.WeakValueDictionary()
+
+    # Number of shared nodes in the table
+    def __len__(self):
+        return len(self.table)
+
+    # Key that identifies a node, the children of a BinaryNode should already be interned
+    def key(self,node):
+        if isinstance(node,BinaryNode):
+            return (type(node),id(node.lhs),id(node.rhs))
+        elif isinstance(node,Constant):
+            return (Constant,type(node.value),node.value)
+        elif isinstance(node,Variable):
+            return (Variable,node.char)
+        else:
+            return (type(node),node.funchar,node.varchar)
+
+    # Returns the shared instance of node, which is node itself if it is not in the table yet
+    # The children of node should already be interned
+    def lookup(self,node):
+        key=self.key(node)
+        shared=self.table.get(key)
+        if shared is None:
+            self.table[key]=node
+            shared=node
+        return shared
+
+    # Returns the shared version of a whole tree (children before parents, without recursion)
+    # Python numbers in the tree are converted to Constant's
+    def intern(self,expr):
+        shared={}
+        for node in postorder(expr):
+            if isinstance(node,(int,float)):
+                shared[id(node)]=self.lookup(Constant(node))
+            elif isinstance(node,BinaryNode):
+                L=shared[id(node.lhs)]
+                R=shared[id(node.rhs)]
+                if L is node.lhs and R is node.rhs:
+                    shared[id(node)]=self.lookup(node)
+                else:
+                    shared[id(node)]=self.lookup(type(node)(L,R))
+            else:
+                shared[id(node)]=self.lookup(node)
+        return shared[id(expr)]
+
+    # Factory: constructs a node and returns the shared instance
+    # e.g. table.make(Constant,2), table.make(AddNode,x,y) or table.make(Basic,'sin','x')
+    def make(self,cls,*args):
+        return self.intern(cls(*args))
+
+#---END Interning------------------------------------------------------------------------------------
+
+
+#---Simplification-------------------------------------------------------------------------------------
+
+# Checks if expr is a numerical Constant, and if it is equal to value
+def isnum(expr,value=None):
+    return isinstance(expr,Constant) and isnumber(expr.value) and (value is None or expr.value==value)
+
+# Negation -a as a tree: for constants, variables and functions this is a leaf, else 0-a
+def negate(expr):
+    if isinstance(expr,BinaryNode):
+        if isinstance(expr,SubtractNode) and isnum(expr.lhs,0):
+            return expr.rhs
+        return SubtractNode(Constant(0),expr)
+    return -expr
+
+# Simplifies the children L, R of node and the node itself with:
+# - constant folding: 1+2 -> 3
+# - identities: a+0,0+a,a-0,a*1,1*a,a/1,a**1 -> a; a*0,0*a,0/a,0**a -> 0; a**0,1**a,a/a -> 1; a-a -> 0; a/(-1) -> -a
+# Note: just like __str__, we ignore difficulties with 0/0 and 0**0
+def simplifyNode(node,L,R):
+    op=node.op_symbol
+    if isnum(L) and isnum(R):
+        # Huge powers of integers are not computed
+        if not (op=='**' and isinstance(L.value,int) and isinstance(R.value,int) and abs(R.value)>1024):
+            try:
+                value=Operators[op](L.value,R.value)
+            except (ArithmeticError,ValueError):
+                value=None
+            # Complex results are not folded
+            if isinstance(value,(int,float)):
+                return Constant(value)
+    if op=='+':
+        if isnum(L,0):
+            return R
+        if isnum(R,0):
+            return L
+    elif op=='-':
+        if isnum(R,0):
+            return L
+        if L==R:
+            return Constant(0)
+    elif op=='*':
+        if isnum(L,0) or isnum(R,0):
+            return Constant(0)
+        if isnum(L,1):
+            return R
+        if isnum(R,1):
+            return L
+    elif op=='/':
+        if isnum(L,0):
+            return Constant(0)
+        if isnum(R,1):
+            return L
+        if isnum(R,-1):
+            return negate(L)
+        if L==R:
+            return Constant(1)
+    elif op=='**':
+        if isnum(R,0) or isnum(L,1):
+            return Constant(1)
+        if isnum(R,1):
+            return L
+        if isnum(L,0):
+            return Constant(0)
+    if L is node.lhs and R is node.rhs:
+        return node
+    return type(node)(L,R)
+
+# Collects like terms in a chain of '+' and '-': 2*x+y-x+3-1 -> x + y + 2
+# Returns a chain with one term per distinct term (in order of appearance) and the constant at the end
+# Nodes with their id in shared are not split up (they are shared by several parents)
+def collectTerms(expr,shared=()):
+    terms={}
+    constant=0
+    stack=[(expr,1)]
+    while stack:
+        node,sign=stack.pop()
+        if (isinstance(node,AddNode) or isinstance(node,SubtractNode)) and (node is expr or id(node) not in shared):
+            stack.append((node.rhs,sign if isinstance(node,AddNode) else -sign))
+            stack.append((node.lhs,sign))
+        elif isnum(node):
+            constant+=sign*node.value
+        elif isinstance(node,MultiplyNode) and isnum(node.lhs):
+            terms[node.rhs]=terms.get(node.rhs,0)+sign*node.lhs.value
+        else:
+            terms[node]=terms.get(node,0)+sign
+    terms=[(term,coefficient) for term,coefficient in terms.items() if coefficient!=0]
+    if terms==[]:
+        return Constant(constant)
+    # A chain should not start with a negative term if possible: -x+y+3 -> y - x + 3, -x+3 -> 3 - x
+    first=[i for i in range(len(terms)) if terms[i][1]>0]
+    if first!=[]:
+        terms.insert(0,terms.pop(first[0]))
+        result=None
+    elif constant!=0:
+        result=Constant(constant)
+        constant=0
+    else:
+        result=None
+    for term,coefficient in terms:
+        if abs(coefficient)!=1:
+            term=MultiplyNode(Constant(abs(coefficient)),term)
+        if result is None:
+            result=term if coefficient>0 else negate(term)
+        elif coefficient>0:
+            result=AddNode(result,term)
+        else:
+            result=SubtractNode(result,term)
+    if constant>0:
+        return AddNode(result,Constant(constant))
+    elif constant<0:
+        return SubtractNode(result,Constant(-constant))
+    return result
+
+# Collects like factors in a chain of '*': 2*x*3*x**2*y -> 6 * x ** 3 * y
+# Returns the numerical coefficient first, followed by one power per distinct base (in order of appearance)
+# Nodes with their id in shared are not split up (they are shared by several parents)
+def collectFactors(expr,shared=()):
+    factors={}
+    coefficient=1
+    stack=[expr]
+    while stack:
+        node=stack.pop()
+        if isinstance(node,MultiplyNode) and (node is expr or id(node) not in shared):
+            stack.append(node.rhs)
+            stack.append(node.lhs)
+        elif isnum(node):
+            coefficient*=node.value
+        elif isinstance(node,SubtractNode) and isnum(node.lhs,0):
+            coefficient=-coefficient
+            stack.append(node.rhs)
+        elif isinstance(node,PowerNode) and isnum(node.rhs):
+            factors[node.lhs]=factors.get(node.lhs,0)+node.rhs.value
+        else:
+            factors[node]=factors.get(node,0)+1
+    if coefficient==0:
+        return Constant(0)
+    result=None
+    for base,exponent in factors.items():
+        if exponent==0:
+            continue
+        factor=base if exponent==1 else PowerNode(base,Constant(exponent))
+        result=factor if result is None else MultiplyNode(result,factor)
+    if result is None:
+        return Constant(coefficient)
+    elif coefficient==1:
+        return result
+    elif coefficient==-1:
+        return negate(result)
+    return MultiplyNode(Constant(coefficient),result)
+
+# Families of operators for collecting: '+' and '-' form one chain, '*' another
+ChainFamily={'+':'sum','-':'sum','*':'product'}
+
+# One bottom-up pass of simplification, every node is visited once (in postorder)
+# leaf(node) gives the replacement of a leaf, by default leaves are kept (Python numbers become Constant's)
+# Like terms and factors are only collected at the top of each chain, so long chains take linear time
+# Nodes that are shared by several parents stay shared: they are not split up by a chain above them
+def simplifyPass(expr,leaf=None):
+    nodes=postorder(expr)
+    # Top of a chain: a node that does not have exactly one parent from the same family
+    parents={}
+    family={}
+    for node in nodes:
+        if isinstance(node,BinaryNode):
+            for child in [node.lhs,node.rhs]:
+                parents[id(child)]=parents.get(id(child),0)+1
+                family[id(child)]=ChainFamily.get(node.op_symbol)
+    simplified={}
+    # The ids of the simplified versions of shared nodes
+    shared=set()
+    for node in nodes:
+        if isinstance(node,BinaryNode):
+            new=simplifyNode(node,simplified[id(node.lhs)],simplified[id(node.rhs)])
+            top=parents.get(id(node),0)!=1 or family.get(id(node))!=ChainFamily.get(node.op_symbol)
+            if top and isinstance(new,BinaryNode) and ChainFamily.get(new.op_symbol)==ChainFamily.get(node.op_symbol):
+                if ChainFamily.get(new.op_symbol)=='sum':
+                    new=collectTerms(new,shared)
+                elif ChainFamily.get(new.op_symbol)=='product':
+                    new=collectFactors(new,shared)
+        elif isinstance(node,(int,float)):
+            new=Constant(node)
+        elif leaf is not None:
+            new=leaf(node)
+        else:
+            new=node
+        simplified[id(node)]=new
+        if parents.get(id(node),0)>1:
+            shared.add(id(new))
+    return simplified[id(expr)]
+
+# Leaf replacement for Expression.specialize: a variable or basic function of a variable in bindings
+# (the variable '-x' is bound by 'x', and 'x' by '-x') becomes the Constant of its value, other leaves are kept
+def bindLeaf(node,bindings):
+    if isinstance(node,Variable):
+        name=node.char
+    elif isinstance(node,Basic):
+        name=node.varchar
+    else:
+        return node
+    if name in bindings or (-Variable(name)).char in bindings:
+        return Constant(node.leafgradient(bindings,False)[0])
+    return node
+
+#---END Simplification---------------------------------------------------------------------------------
+
+
+
+#---Bytecode-------------------------------------------------------------------------------------------
+
+# An expression as a linear list of instructions for a stack machine (see Expression.to_bytecode)
+# e.g. (2+x)*y is: PUSH_CONST 2, LOAD_VAR x, ADD, LOAD_VAR y, MUL
+# Every instruction is an opcode (array('B')) and an argument (array('i')): the position in the table
+# of constants for PUSH_CONST, in the table of variable names for LOAD_VAR, and of a temporary for
+# STORE_TEMP/LOAD_TEMP. An operation that is shared by several parents is computed once and kept
+# in a temporary (STORE_TEMP copies the top of the stack), the other parents load it (LOAD_TEMP).
+
+# Opcodes
+PUSH_CONST,LOAD_VAR,ADD,SUB,MUL,DIV,POW,NEG,CALL_SIN,CALL_COS,CALL_LOG,STORE_TEMP,LOAD_TEMP=range(13)
+OpNames=['PUSH_CONST','LOAD_VAR','ADD','SUB','MUL','DIV','POW','NEG','CALL_SIN','CALL_COS','CALL_LOG','STORE_TEMP','LOAD_TEMP']
+BinaryOpcodes={'+':ADD,'-':SUB,'*':MUL,'/':DIV,'**':POW}
+CallOpcodes={'sin':CALL_SIN,'cos':CALL_COS,'log':CALL_LOG}
+
+class Bytecode():
+
+    def __init__(self,ops,args,constants,names,ntemps):
+        self.ops=ops
+        self.args=args
+        self.constants=constants
+        self.names=names
+        self.ntemps=ntemps
+        # The largest number of values on the stack, so the stack can be allocated at once
+        depth=0
+        self.depth=0
+        for op in ops:
+            if op in (PUSH_CONST,LOAD_VAR,LOAD_TEMP):
+                depth+=1
+            elif ADD<=op<=POW:
+                depth-=1
+            self.depth=max(self.depth,depth)
+
+    # Number of instructions
+    def __len__(self):
+        return len(self.ops)
+
+    # Overload: String str, one instruction per line
+    def __str__(self):
+        lines=[]
+        for op,arg in zip(self.ops,self.args):
+            if op==PUSH_CONST:
+                lines.append('%s %r' % (OpNames[op],self.constants[arg]))
+            elif op==LOAD_VAR:
+                lines.append('%s %s' % (OpNames[op],self.names[arg]))
+            elif op in (STORE_TEMP,LOAD_TEMP):
+                lines.append('%s %d' % (OpNames[op],arg))
+            else:
+                lines.append(OpNames[op])
+        return '\n'.join(lines)
+
+    # Translates an expression to bytecode, the nodes are visited with an explicit stack (no recursion)
+    @staticmethod
+    def fromExpression(expr):
+        # Shared nodes have more than one parent
+        parents={}
+        for node in postorder(expr):
+            if isinstance(node,BinaryNode):
+                for child in [node.lhs,node.rhs]:
+                    parents[id(child)]=parents.get(id(child),0)+1
+        ops=array('B')
+        args=array('i')
+        constants=[]
+        names=[]
+        temps={}
+        stack=[(expr,False)]
+        while stack:
+            node,expanded=stack.pop()
+            if id(node) in temps:
+                ops.append(LOAD_TEMP)
+                args.append(temps[id(node)])
+                continue
+            if isinstance(node,BinaryNode) and not expanded:
+                stack.append((node,True))
+                stack.append((node.rhs,False))
+                stack.append((node.lhs,False))
+                continue
+            if isinstance(node,BinaryNode):
+                ops.append(BinaryOpcodes[node.op_symbol])
+                args.append(0)
+            elif isinstance(node,(Constant,int,float)):
+                value=node.value if isinstance(node,Constant) else node
+                if not isnumber(value):
+                    raise ValueError('Cannot translate non-numerical constant: %s' % value)
+                ops.append(PUSH_CONST)
+                args.append(len(constants))
+                constants.append(value)
+            else:
+                # Variables and basic functions: load the variable, call the function and negate
+                char=node.char if isinstance(node,Variable) else node.varchar
+                if char.lstrip('-') not in names:
+                    names.append(char.lstrip('-'))
+                ops.append(LOAD_VAR)
+                args.append(names.index(char.lstrip('-')))
+                if char[0]=='-':
+                    ops.append(NEG)
+                    args.append(0)
+                if isinstance(node,Basic):
+                    name=node.funchar.lstrip('-')
+                    if name not in CallOpcodes:
+                        raise ValueError('Cannot translate unknown function: %s' % node.funchar)
+                    ops.append(CallOpcodes[name])
+                    args.append(0)
+                    if node.funchar[0]=='-':
+                        ops.append(NEG)
+                        args.append(0)
+                elif not isinstance(node,Variable):
+                    raise ValueError('Cannot translate node: %s' % node)
+            # (a shared leaf is cheaper to load again than to keep in a temporary)
+            if parents.get(id(node),0)>1 and isinstance(node,BinaryNode):
+                temps[id(node)]=len(temps)
+                ops.append(STORE_TEMP)
+                args.append(temps[id(node)])
+        return Bytecode(ops,args,constants,names,len(temps))
+
+    # Runs the bytecode, env maps the names of the variables to numbers, returns a float
+    # The stack and the temporaries are allocated once, with their final size, before the loop
+    def run(self,env):
+        try:
+            variables=[env[name] for name in self.names]
+        except KeyError as error:
+            raise ValueError('No value for variable: %s' % error.args[0])
+        constants=self.constants
+        stack=[0.0]*self.depth
+        temps=[0.0]*self.ntemps
+        sp=-1
+        for op,arg in zip(self.ops,self.args):
+            if op==LOAD_VAR:
+                sp+=1
+                stack[sp]=variables[arg]
+            elif op==PUSH_CONST:
+                sp+=1
+                stack[sp]=constants[arg]
+            elif op==ADD:
+                sp-=1
+                stack[sp]=stack[sp]+stack[sp+1]
+            elif op==MUL:
+                sp-=1
+                stack[sp]=stack[sp]*stack[sp+1]
+            elif op==SUB:
+                sp-=1
+                stack[sp]=stack[sp]-stack[sp+1]
+            elif op==DIV:
+                sp-=1
+                stack[sp]=stack[sp]/stack[sp+1]
+            elif op==POW:
+                sp-=1
+                stack[sp]=stack[sp]**stack[sp+1]
+            elif op==NEG:
+                stack[sp]=-stack[sp]
+            elif op==CALL_SIN:
+                stack[sp]=math.sin(stack[sp])
+            elif op==CALL_COS:
+                stack[sp]=math.cos(stack[sp])
+            elif op==CALL_LOG:
+                stack[sp]=math.log(stack[sp])
+            elif op==STORE_TEMP:
+                temps[arg]=stack[sp]
+            else:
+                sp+=1
+                stack[sp]=temps[arg]
+        return float(stack[0])
+
+    #---Serialization------------------------------------------------------------------------------
+
+    # The bytecode as bytes, e.g. to send it to another process or to store it
+    # Layout: 'ETBC', the numbers of instructions and temporaries (2 x 4 bytes, little-endian),
+    # the opcodes (1 byte each), the arguments (4 bytes each, little-endian),
+    # and the constants and names as JSON
+    def tobytes(self):
+        args=array('i',self.args)
+        if sys.byteorder=='big':
+            args.byteswap()
+        tables=json.dumps([self.constants,self.names]).encode('utf-8')
+        return b'ETBC'+struct.pack('<ii',len(self.ops),self.ntemps)+self.ops.tobytes()+args.tobytes()+tables
+
+    # Reads bytecode that was written by tobytes
+    @staticmethod
+    def frombytes(data):
+        if data[:4]!=b'ETBC':
+            raise ValueError('Not bytecode')
+        n,ntemps=struct.unpack('<ii',data[4:12])
+        ops=array('B',data[12:12+n])
+        args=array('i')
+        args.frombytes(data[12+n:12+5*n])
+        if sys.byteorder=='big':
+            args.byteswap()
+        constants,names=json.loads(data[12+5*n:].decode('utf-8'))
+        return Bytecode(ops,args,constants,names,ntemps)
+
+    #---END Serialization--------------------------------------------------------------------------
+
+#---END Bytecode---------------------------------------------------------------------------------------
+
+
+#---Incremental evaluation-----------------------------------------------------------------------------
+
+# Evaluates an expression repeatedly for values of the variables that change only partly between calls, e.g.
+# context=EvaluationContext(expr)
+# for y in sweep: context.evaluate({'x':1,'y':y})  -> only the nodes that depend on y are computed again
+# The value of every node is cached, and for every variable the nodes that depend on it are known,
+# so only these nodes are computed again (in postorder, children before parents) when the variable changes
+# All variables should have numerical values, the result is a float
+# A variable '-x' depends on x (its value is -x, unless '-x' itself has a value, see Variable.evaluate)
+class EvaluationContext():
+
+    def __init__(self,expr):
+        self.expr=expr
+        self.nodes=postorder(expr)
+        position={id(node):k for k,node in enumerate(self.nodes)}
+        # Positions of the children of the operations
+        self.children=[(position[id(node.lhs)],position[id(node.rhs)]) if isinstance(node,BinaryNode) else None for node in self.nodes]
+        # For every variable the positions of the nodes that depend on it (in postorder)
+        names=[]
+        for node in self.nodes:
+            if isinstance(node,BinaryNode):
+                names.append(names[position[id(node.lhs)]] | names[position[id(node.rhs)]])
+            elif isinstance(node,Variable):
+                names.append(frozenset([node.char.lstrip('-')]))
+            elif isinstance(node,Function):
+                names.append(frozenset([node.varchar.lstrip('-')]))
+            else:
+                names.append(frozenset())
+        self.dependents={}
+        for k,depends in enumerate(names):
+            for name in depends:
+                self.dependents.setdefault(name,[]).append(k)
+        self.values=[None]*len(self.nodes)
+        # The values of the variables of the last evaluation (None: nothing is cached)
+        self.last=None
+        # Number of nodes that were computed by the last evaluation
+        self.computed=0
+
+    # Values of a variable that the nodes read from Dic (see the class comment)
+    def lookup(self,name,Dic):
+        return (Dic.get(name),Dic.get('-'+name))
+
+    def evaluate(self,Dic={}):
+        current={name:self.lookup(name,Dic) for name in self.dependents}
+        if self.last is None:
+            positions=range(len(self.nodes))
+        else:
+            changed=[name for name in self.dependents if current[name]!=self.last[name]]
+            if len(changed)==1:
+                positions=self.dependents[changed[0]]
+            else:
+                positions=sorted(set(k for name in changed for k in self.dependents[name]))
+        self.last=None
+        values=self.values
+        nodes=self.nodes
+        children=self.children
+        for k in positions:
+            node=nodes[k]
+            if children[k] is not None:
+                l,r=children[k]
+                values[k]=Operators[node.op_symbol](values[l],values[r])
+            elif isinstance(node,(int,float)):
+                values[k]=float(node)
+            else:
+                values[k]=node.leafgradient(Dic,False)[0]
+        # Only after a successful evaluation the cached values are complete
+        self.last=current
+        self.computed=len(positions)
+        return values[-1]
+
+#---END Incremental evaluation-------------------------------------------------------------------------
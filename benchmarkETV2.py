@@ -0,0 +1,410 @@
+import time
+from ETV2 import *
+
+# Benchmarks for the expression trees of ETV2.py
+# Run as: python benchmarkETV2.py
+
+# Builds a tree of the given depth, where every level adds a variable and an operation
+# e.g. depth 3: ((x0 + x1) * x2) - x0
+def chainTree(depth,nvars=3):
+    ops=[AddNode,MultiplyNode,SubtractNode]
+    tree=Variable('x0')
+    for i in range(1,depth+1):
+        tree=ops[i%len(ops)](tree,Variable('x%d' % (i%nvars)))
+    return tree
+
+# Builds a complete binary tree of the given depth, leaves are variables and constants
+def balancedTree(depth,nvars=3):
+    ops=[AddNode,MultiplyNode,SubtractNode]
+    level=[Variable('x%d' % (i%nvars)) if i%2==0 else Constant(i%5+1) for i in range(2**depth)]
+    d=0
+    while len(level)>1:
+        level=[ops[d%len(ops)](level[i],level[i+1]) for i in range(0,len(level),2)]
+        d+=1
+    return level[0]
+
+# Runs func repeatedly for at least mintime seconds, returns the time per call
+def timeit(func,mintime=0.2):
+    calls=0
+    start=time.perf_counter()
+    while True:
+        func()
+        calls+=1
+        elapsed=time.perf_counter()-start
+        if elapsed>=mintime:
+            return elapsed/calls
+
+#---Benchmark: evaluate--------------------------------------------------------
+
+# Evaluation should scale linearly with the number of nodes,
+# so the time per node should stay (roughly) constant
+def benchmarkEvaluate():
+    Dic={'x0':0.5,'x1':-0.25,'x2':0.75}
+    print('evaluate: balanced trees')
+    print('%8s %10s %14s %14s' % ('depth','nodes','time (s)','time/node (s)'))
+    for depth in range(4,17,2):
+        tree=balancedTree(depth)
+        t=timeit(lambda: tree.evaluate(Dic))
+        print('%8d %10d %14.6f %14.3e' % (depth,tree.size(),t,t/tree.size()))
+    print('evaluate: chains (deep trees)')
+    print('%8s %10s %14s %14s' % ('depth','nodes','time (s)','time/node (s)'))
+    for depth in [30,300,3000,30000]:
+        tree=chainTree(depth)
+        t=timeit(lambda: tree.evaluate(Dic))
+        print('%8d %10d %14.6f %14.3e' % (depth,tree.size(),t,t/tree.size()))
+    # Both children of every node are the same object: a tree of depth 30 has 2**31-1 nodes,
+    # but each shared node is evaluated only once
+    print('evaluate: shared subtrees')
+    print('%8s %10s %14s %14s' % ('depth','nodes','time (s)','time/node (s)'))
+    tree=Variable('x0')
+    for i in range(30):
+        tree=AddNode(tree,tree)
+    t=timeit(lambda: tree.evaluate(Dic))
+    print('%8d %10d %14.6f %14.3e' % (30,tree.size(),t,t/tree.size()))
+
+#---END Benchmark: evaluate----------------------------------------------------
+
+#---Benchmark: compile---------------------------------------------------------
+
+# Compares evaluate with a compiled function for repeated evaluation of the same expression
+def benchmarkCompile():
+    Dic={'x0':0.5,'x1':-0.25,'x2':0.75}
+    print('compile: balanced trees')
+    print('%8s %10s %14s %14s %14s' % ('depth','nodes','compile (s)','evaluate (s)','compiled (s)'))
+    for depth in range(4,13,2):
+        tree=balancedTree(depth)
+        start=time.perf_counter()
+        f=tree.compile()
+        tcompile=time.perf_counter()-start
+        tevaluate=timeit(lambda: tree.evaluate(Dic))
+        tcompiled=timeit(lambda: f(**Dic))
+        print('%8d %10d %14.6f %14.3e %14.3e' % (depth,tree.size(),tcompile,tevaluate,tcompiled))
+
+#---END Benchmark: compile-----------------------------------------------------
+
+#---Benchmark: evaluate_array--------------------------------------------------
+
+# Compares one vectorized evaluation over n points with n compiled calls
+def benchmarkEvaluateArray(n=10**6):
+    import numpy as np
+    tree=balancedTree(6)
+    env={'x0':np.linspace(0,1,n),'x1':np.linspace(-1,0,n),'x2':np.linspace(1,2,n)}
+    f=tree.compile()
+    tarray=timeit(lambda: tree.evaluate_array(env))
+    start=time.perf_counter()
+    for x0,x1,x2 in zip(env['x0'][:10**4],env['x1'][:10**4],env['x2'][:10**4]):
+        f(x0,x1,x2)
+    tcompiled=(time.perf_counter()-start)*n/10**4
+    print('evaluate_array: %d nodes, %d points' % (tree.size(),n))
+    print('%14s %14s' % ('array (s)','compiled (s)'))
+    print('%14.6f %14.6f' % (tarray,tcompiled))
+
+#---END Benchmark: evaluate_array----------------------------------------------
+
+#---Benchmark: str-------------------------------------------------------------
+
+# Printing should scale linearly with the number of nodes
+def benchmarkStr():
+    print('str: balanced trees and chains')
+    print('%10s %12s %14s %14s' % ('nodes','length','time (s)','time/node (s)'))
+    for tree in [balancedTree(depth) for depth in range(6,17,2)]+[chainTree(depth) for depth in [300,3000,30000]]:
+        t=timeit(lambda: str(tree))
+        print('%10d %12d %14.6f %14.3e' % (tree.size(),len(str(tree)),t,t/tree.size()))
+
+#---END Benchmark: str---------------------------------------------------------
+
+#---Benchmark: parse-----------------------------------------------------------
+
+# Formulas per second for tokenize, parsing without cache (parseString) and fromString (with cache)
+def benchmarkParse():
+    formulas=['(2+x)*y-(3-y)**3','((2*y)**3)-(3-x)','-x**2 + 2*sin(y) - log(z)/3','1.5e-3*x0*x1 + x2**-2']
+    formulas+=[str(balancedTree(depth)) for depth in [3,5,7]]
+    print('parse')
+    print('%10s %16s %16s %16s' % ('length','tokenize (1/s)','parse (1/s)','cached (1/s)'))
+    for formula in formulas:
+        ttokenize=timeit(lambda: tokenize(formula))
+        tparse=timeit(lambda: parseString(formula))
+        tcached=timeit(lambda: Expression.fromString(formula))
+        print('%10d %16.0f %16.0f %16.0f' % (len(formula),1/ttokenize,1/tparse,1/tcached))
+    start=time.perf_counter()
+    for i in range(10000):
+        parseString(formulas[i%len(formulas)])
+    print('10000 formulas parsed in %.3f s' % (time.perf_counter()-start))
+
+#---END Benchmark: parse-------------------------------------------------------
+
+#---Benchmark: simplify--------------------------------------------------------
+
+# Number of nodes of derivatives before and after simplify, and the time simplify takes
+def benchmarkSimplify():
+    formulas=['(2+x)*y-(3-y)**3','((2*y)**3)-(3-x)','x*x*x*x + 3*x*y - y/x','(x+1)**4*(y-2)**3/(x*y+1)','sin(x)*x**2-log(x)*y']
+    print('simplify: derivatives')
+    print('%32s %4s %10s %10s %14s' % ('formula','var','nodes','simplified','time (s)'))
+    for formula in formulas:
+        for var in ['x','y']:
+            d=Expression.fromString(formula).diff(var)
+            t=timeit(lambda: d.simplify())
+            print('%32s %4s %10d %10d %14.6f' % (formula,var,d.size(),d.simplify().size(),t))
+    print('simplify: higher derivatives of (x+1)**4*(y-2)**3/(x*y+1) to x')
+    print('%8s %10s %10s %14s' % ('order','nodes','simplified','time (s)'))
+    d=Expression.fromString('(x+1)**4*(y-2)**3/(x*y+1)')
+    for order in range(1,5):
+        d=d.diff('x')
+        start=time.perf_counter()
+        simple=d.simplify()
+        print('%8d %10d %10d %14.6f' % (order,d.size(),simple.size(),time.perf_counter()-start))
+        d=simple
+    print('simplify: long sums')
+    print('%10s %10s %14s' % ('nodes','simplified','time (s)'))
+    for n in [1000,10000,100000]:
+        tree=Variable('x0')
+        for i in range(1,n):
+            tree=tree+Variable('x%d' % (i%10))*Constant(i%3)
+        start=time.perf_counter()
+        simple=tree.simplify()
+        print('%10d %10d %14.6f' % (tree.size(),simple.size(),time.perf_counter()-start))
+
+#---END Benchmark: simplify----------------------------------------------------
+
+#---Benchmark: diff------------------------------------------------------------
+
+# Higher order derivatives: with the cached derivatives and shared subtrees,
+# the number of distinct nodes grows about linearly with the size of the previous derivative
+def benchmarkDiff():
+    # Trees made with operator overloading have Python numbers as children, also in their derivatives
+    x=Variable('x')
+    assert ((x*2)*x).diff('x').evaluate({'x':1.0}).value==4
+    print('diff: higher derivatives of x*sin(x)/(x+1) to x')
+    print('%8s %10s %14s %12s %14s' % ('order','nodes','time (s)','simplified','time (s)'))
+    d=Expression.fromString('x*sin(x)/(x+1)')
+    simple=d
+    for order in range(1,11):
+        start=time.perf_counter()
+        d=d.diff('x')
+        t=time.perf_counter()-start
+        start=time.perf_counter()
+        simple=simple.derivative('x')
+        tsimple=time.perf_counter()-start
+        print('%8d %10d %14.6f %12d %14.6f' % (order,d.size(),t,simple.size(),tsimple))
+
+#---END Benchmark: diff--------------------------------------------------------
+
+#---Benchmark: gradient--------------------------------------------------------
+
+# Reverse mode computes all partial derivatives in one forward and one backward sweep,
+# the symbolic alternative builds (and evaluates) a derivative tree for every variable
+def benchmarkGradient():
+    print('gradient: all partial derivatives of a chain of nodes')
+    print('%10s %8s %14s %14s' % ('nodes','vars','reverse (s)','diff (s)'))
+    for nvars in [3,10,30]:
+        tree=chainTree(300,nvars)
+        point={'x%d' % i:1.0+i/nvars for i in range(nvars)}
+        treverse=timeit(lambda: tree.gradient(point))
+        tdiff=timeit(lambda: [tree.diff(var).evaluate(point) for var in point])
+        print('%10d %8d %14.6f %14.6f' % (tree.size(),nvars,treverse,tdiff))
+
+#---END Benchmark: gradient----------------------------------------------------
+
+#---Benchmark: compact---------------------------------------------------------
+
+# Memory per node of the object trees and of the compact (array) representation,
+# and a chain that is much deeper than the recursion limit
+def benchmarkCompact():
+    import tracemalloc
+    from ETCompact import CompactExpression
+    print('compact: memory per node')
+    print('%10s %14s %14s %14s' % ('nodes','tree (B)','compact (B)','convert (s)'))
+    for depth in [10,14,17]:
+        tracemalloc.start()
+        tree=balancedTree(depth)
+        treebytes=tracemalloc.get_traced_memory()[0]
+        start=time.perf_counter()
+        compact=CompactExpression.fromTree(tree)
+        tconvert=time.perf_counter()-start
+        tracemalloc.stop()
+        n=tree.size()
+        print('%10d %14.1f %14.1f %14.6f' % (n,treebytes/n,compact.nbytes()/len(compact),tconvert))
+    # Many small formulas (of the benchmark suite), where the memory per object matters more than per node
+    from benchmarkSuite import randomExpression
+    nformulas=10000
+    tracemalloc.start()
+    trees=[randomExpression(3,1,3,seed) for seed in range(nformulas)]
+    treebytes=tracemalloc.get_traced_memory()[0]
+    compacts=[CompactExpression.fromTree(tree) for tree in trees]
+    compactbytes=tracemalloc.get_traced_memory()[0]-treebytes
+    tracemalloc.stop()
+    nodes=sum(tree.size() for tree in trees)/nformulas
+    print('compact: memory per formula, %d formulas of %.1f nodes' % (nformulas,nodes))
+    print('%14s %14s' % ('tree (B)','compact (B)'))
+    print('%14.1f %14.1f' % (treebytes/nformulas,compactbytes/nformulas))
+    tree=chainTree(10**5)
+    compact=CompactExpression.fromTree(tree)
+    point={'x0':1.0,'x1':2.0,'x2':0.5}
+    start=time.perf_counter()
+    compact.diff('x1').evaluate(point)
+    print('chain of %d nodes: diff and evaluate in %.3f s' % (len(compact),time.perf_counter()-start))
+
+#---END Benchmark: compact-----------------------------------------------------
+
+#---Benchmark: construction----------------------------------------------------
+
+# Time and memory per node to build a tree (the nodes use __slots__ and are immutable)
+def benchmarkConstruct():
+    import tracemalloc
+    print('construction: time and memory per node')
+    print('%10s %14s %14s' % ('nodes','time (us)','memory (B)'))
+    for depth in [10,14,17]:
+        n=balancedTree(depth).size()
+        t=timeit(lambda: balancedTree(depth))
+        tracemalloc.start()
+        tree=balancedTree(depth)
+        memory=tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        print('%10d %14.3f %14.1f' % (n,t/n*1e6,memory/n))
+
+#---END Benchmark: construction------------------------------------------------
+
+#---Benchmark: bytecode--------------------------------------------------------
+
+# The stack machine against evaluate, on the sample expressions of ET.py and on larger trees
+def benchmarkBytecode():
+    a=Constant(2)
+    b=Constant(3)
+    c=Variable('x')
+    d=Variable('y')
+    samples=[('(a+c)*d-(b-d)**b',(a+c)*d-(b-d)**b,{'x':-2,'y':1}),
+             ('((a*d)**b)-(b-c)',((a*d)**b)-(b-c),{'x':-1,'y':0}),
+             ('balanced 1023 nodes',balancedTree(10),{'x0':1.0,'x1':0.5,'x2':2.0})]
+    print('bytecode: evaluate against the stack machine (time per evaluation)')
+    print('%22s %14s %14s %14s' % ('expression','evaluate (s)','bytecode (s)','translate (s)'))
+    for name,expr,env in samples:
+        code=expr.to_bytecode()
+        assert code.run(env)==float(expr.evaluate(env))
+        tevaluate=timeit(lambda: expr.evaluate(env))
+        trun=timeit(lambda: code.run(env))
+        ttranslate=timeit(lambda: expr.to_bytecode())
+        print('%22s %14.8f %14.8f %14.8f' % (name,tevaluate,trun,ttranslate))
+
+#---END Benchmark: bytecode----------------------------------------------------
+
+#---Benchmark: batch-----------------------------------------------------------
+
+# Many expressions for many environments: evaluate in a loop, and evaluateBatch in this process and
+# with a pool of worker processes (the speedup depends on the number of CPUs)
+def benchmarkBatch(nexpr=20,nenv=10000):
+    import os
+    from ETBatch import evaluateBatch
+    expressions=[balancedTree(5+i%3,nvars=4) for i in range(nexpr)]
+    environments=[{'x%d' % j:1.0+(i*j)%7/7 for j in range(4)} for i in range(nenv)]
+    print('batch: %d expressions, %d environments, %s CPUs' % (nexpr,nenv,os.cpu_count()))
+    print('%20s %14s' % ('method','time (s)'))
+    start=time.perf_counter()
+    for env in environments[:nenv//20]:
+        [expr.evaluate(env) for expr in expressions]
+    print('%20s %14.3f' % ('evaluate',(time.perf_counter()-start)*20))
+    for workers in [0,os.cpu_count()]:
+        start=time.perf_counter()
+        for values in evaluateBatch(expressions,environments,workers=workers):
+            pass
+        print('%20s %14.3f' % ('batch, %d workers' % workers,time.perf_counter()-start))
+
+#---END Benchmark: batch-------------------------------------------------------
+
+#---Benchmark: cse-------------------------------------------------------------
+
+# Common subexpression elimination of (unsimplified) derivatives of x*sin(x)/(x+1),
+# and the time to evaluate the derivative before and after
+def benchmarkCSE():
+    print('cse: derivatives of x*sin(x)/(x+1) to x')
+    print('%8s %10s %10s %12s %12s %14s %14s' % ('order','nodes','dag','eliminated','cse (s)','evaluate (s)','after cse (s)'))
+    d=Expression.fromString('x*sin(x)/(x+1)')
+    point={'x':0.7}
+    for order in range(1,9):
+        d=d.diff('x')
+        start=time.perf_counter()
+        dag,eliminated=d.cse()
+        tcse=time.perf_counter()-start
+        tbefore=timeit(lambda: d.evaluate(point))
+        tafter=timeit(lambda: dag.evaluate(point))
+        print('%8d %10d %10d %12d %12.6f %14.6f %14.6f' % (order,d.size(),dag.size(),eliminated,tcse,tbefore,tafter))
+
+#---END Benchmark: cse---------------------------------------------------------
+
+#---Benchmark: incremental-----------------------------------------------------
+
+# A sweep over one variable of a sum of terms, where every term has its own variable:
+# evaluate computes every node for every value, EvaluationContext only the nodes of one term (and the sum)
+def benchmarkIncremental(nterms=20,depth=100):
+    ops=[AddNode,MultiplyNode,SubtractNode]
+    tree=None
+    for i in range(nterms):
+        term=Variable('p%d' % i)
+        for j in range(depth):
+            term=ops[j%len(ops)](term,Variable('p%d' % i) if j%2 else Constant(j%5+1))
+        tree=term if tree is None else AddNode(tree,term)
+    point={'p%d' % i:0.5 for i in range(nterms)}
+    context=EvaluationContext(tree)
+    context.evaluate(point)
+    sweep=[0.5+k/1000 for k in range(100)]
+    def full():
+        for value in sweep:
+            point['p0']=value
+            tree.evaluate(point)
+    def incremental():
+        for value in sweep:
+            point['p0']=value
+            context.evaluate(point)
+    print('incremental: sweep of p0 over %d values, %d nodes' % (len(sweep),tree.size()))
+    print('%14s %16s %18s' % ('evaluate (s)','incremental (s)','nodes computed'))
+    print('%14.6f %16.6f %18d' % (timeit(full),timeit(incremental),context.computed))
+
+#---END Benchmark: incremental-------------------------------------------------
+
+#---Benchmark: specialize------------------------------------------------------
+
+# A polynomial sum(a_i x**i + b_i sin(x)) of x where the coefficients are fixed (per customer) and only x changes:
+# evaluate of the whole tree for every x, against specialize once and the compiled residual for every x
+def benchmarkSpecialize(degree=50,npoints=100):
+    tree=Constant(0)
+    for i in range(degree):
+        tree=AddNode(tree,AddNode(MultiplyNode(Variable('a%d' % i),PowerNode(Variable('x'),Constant(i))),
+                                  MultiplyNode(Variable('b%d' % i),Basic('sin','x'))))
+    bindings={}
+    for i in range(degree):
+        bindings['a%d' % i]=(i%3)/(i+1)
+        bindings['b%d' % i]=1.0 if i==0 else 0.0
+    xs=[k/npoints for k in range(npoints)]
+    residual=tree.specialize(bindings)
+    compiled=residual.compile()
+    for x in xs[:5]:
+        point=dict(bindings,x=x)
+        assert abs(tree.evaluate(point).value-compiled(x))<=1e-9*max(1,abs(compiled(x)))
+    def full():
+        for x in xs:
+            tree.evaluate(dict(bindings,x=x))
+    def specialized():
+        f=tree.specialize(bindings).compile()
+        for x in xs:
+            f(x)
+    print('specialize: %d values of x, %d nodes, residual of %d nodes' % (npoints,tree.size(),residual.size()))
+    print('%14s %16s %22s' % ('evaluate (s)','specialize (s)','specialize+compile (s)'))
+    print('%14.6f %16.6f %22.6f' % (timeit(full),timeit(lambda: tree.specialize(bindings)),timeit(specialized)))
+
+#---END Benchmark: specialize--------------------------------------------------
+
+if __name__=='__main__':
+    benchmarkEvaluate()
+    benchmarkCompile()
+    benchmarkEvaluateArray()
+    benchmarkStr()
+    benchmarkParse()
+    benchmarkSimplify()
+    benchmarkDiff()
+    benchmarkGradient()
+    benchmarkCompact()
+    benchmarkConstruct()
+    benchmarkBytecode()
+    benchmarkBatch()
+    benchmarkCSE()
+    benchmarkIncremental()
+    benchmarkSpecialize()
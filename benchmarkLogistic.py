@@ -0,0 +1,86 @@
+import time
+import numpy as np
+from logistic import *
+
+# Benchmarks for the logistic regression of voorbeeld(1).py
+# Run as: python benchmarkLogistic.py
+
+# Random data set: m samples with n features, and labels 0/1 from random weights
+def syntheticData(m, n, seed=0):
+    rng = np.random.default_rng(seed)
+    X = rng.standard_normal((m, n))
+    w = rng.standard_normal(n)/np.sqrt(n)
+    y = (X @ w + 0.1*rng.standard_normal(m) > 0).astype(np.float64)
+    return X, y
+
+#---Benchmark: misfit and gradient---------------------------------------------
+
+# The original misfit and gradient of voorbeeld(1).py, for comparison
+def misfitOriginal(p, X, y):
+    sigmoid = lambda x: 1/(1+np.exp(-x))
+    yt = sigmoid(np.dot(X,p[:-1]) + p[-1])
+    residual = yt - y
+    return np.dot(residual,residual)
+
+def gradientOriginal(p, X, y):
+    sigmoid = lambda x: 1/(1+np.exp(-x))
+    s = np.dot(X,p[:-1]) + p[-1]
+    yt = sigmoid(s)
+    g = np.zeros(len(p))
+    g[:-1] = 2*np.dot(np.transpose(X)*sigmoid(s)*(1 - sigmoid(s))*(yt - y),np.ones(len(yt)))
+    g[-1]  = 2*np.dot(sigmoid(s)*(1 - sigmoid(s))*(yt - y),np.ones(len(yt)))
+    return g
+
+# misfit and gradient separately (as in voorbeeld(1).py) against misfitGradient, on X of m x n
+def benchmarkMisfitGradient(m=10**6, n=100, repeat=3):
+    X, y = syntheticData(m, n)
+    p = np.full(n+1, 0.01)
+    f, g = misfitGradient(p, X, y)
+    assert np.isclose(f, misfitOriginal(p, X, y)) and np.allclose(g, gradientOriginal(p, X, y))
+    print('misfit and gradient: X of %d x %d' % (m, n))
+    print('%14s %14s' % ('original (s)', 'fused (s)'))
+    start = time.perf_counter()
+    for i in range(repeat):
+        misfitOriginal(p, X, y)
+        gradientOriginal(p, X, y)
+    toriginal = (time.perf_counter()-start)/repeat
+    start = time.perf_counter()
+    for i in range(repeat):
+        misfitGradient(p, X, y)
+    tfused = (time.perf_counter()-start)/repeat
+    print('%14.4f %14.4f' % (toriginal, tfused))
+
+#---END Benchmark: misfit and gradient-----------------------------------------
+
+#---Benchmark: train-----------------------------------------------------------
+
+# Passes over the data needed to reach the misfit of 200 steps of gradient descent with a fixed step
+# (the training loop of voorbeeld(1).py), for the methods of train
+def benchmarkTrain(m=10**5, n=20, steps=200, alpha=1.0):
+    X, y = syntheticData(m, n)
+    p = np.zeros(n+1)
+    start = time.perf_counter()
+    for i in range(steps):
+        f, g = misfitGradient(p, X, y)
+        p -= alpha*g/m
+    target = misfit(p, X, y)
+    tfixed = time.perf_counter()-start
+    print('train: X of %d x %d, passes to reach the misfit %.1f of %d fixed steps' % (m, n, target, steps))
+    print('%10s %10s %10s %12s' % ('method', 'batch', 'passes', 'time (s)'))
+    print('%10s %10s %10d %12.3f' % ('fixed', m, steps, tfixed))
+    for method, batchsize in [('gd', None), ('momentum', None), ('adam', None), ('momentum', 512), ('adam', 512)]:
+        p, history = train(np.zeros(n+1), X, y, method=method, batchsize=batchsize, epochs=steps)
+        passes = next((epoch for epoch, f, norm in history if f <= target), None)
+        if passes is None:
+            print('%10s %10s %10s %12s' % (method, batchsize or m, '>%d' % steps, '-'))
+            continue
+        # time of the passes that are needed
+        start = time.perf_counter()
+        train(np.zeros(n+1), X, y, method=method, batchsize=batchsize, epochs=passes)
+        print('%10s %10s %10d %12.3f' % (method, batchsize or m, passes, time.perf_counter()-start))
+
+#---END Benchmark: train-------------------------------------------------------
+
+if __name__=='__main__':
+    benchmarkMisfitGradient()
+    benchmarkTrain()
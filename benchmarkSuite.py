@@ -0,0 +1,163 @@
+import json
+import platform
+import random
+import sys
+import time
+import tracemalloc
+from ETV2 import *
+
+# Reproducible benchmarks of the main operations of ETV2.py on random expressions
+# For every size of the expressions and every operation the time (the best of a few runs) and the peak memory
+# are measured against the number of nodes, the results can be saved as JSON and compared with an earlier run
+# Run as: python benchmarkSuite.py [results.json [earlier.json]]
+
+# Random expression: the sum of width random trees of depth at most depth, with the variables x0, ..., x(nvars-1)
+# Below the root of every tree, a node is a leaf with probability leafprob (else it is an operation), at the
+# given depth it is always a leaf. Leaves are variables, constants, basic functions and squares of variables.
+# The same arguments (and seed) always give the same expression. All variables should have values in
+# [0.5,1.5] (e.g. from randomPoint), then the denominators, which have no '-' and no log, are positive.
+def randomExpression(depth,width=1,nvars=3,seed=0,leafprob=0.1):
+    rng=random.Random(seed)
+    names=['x%d' % i for i in range(nvars)]
+    ops=[AddNode,SubtractNode,MultiplyNode,DivideNode]
+
+    # positive: the leaf should be positive (sin and cos are positive on [0.5,1.5])
+    def leaf(positive):
+        r=rng.random()
+        if r<0.5:
+            return Variable(rng.choice(names))
+        elif r<0.75:
+            return Constant(rng.randint(1,9))
+        elif r<0.9:
+            return Basic(rng.choice(['sin','cos'] if positive else ['sin','cos','log']),rng.choice(names))
+        return PowerNode(Variable(rng.choice(names)),Constant(2))
+
+    terms=[]
+    for i in range(width):
+        # Top-down with an explicit stack: (depth of the node, parent slot, positive), the children are filled
+        # in afterwards
+        nodes={}
+        stack=[(0,None,False)]
+        order=[]
+        while stack:
+            level,slot,positive=stack.pop()
+            key=len(order)
+            if level==depth or (level>0 and rng.random()<leafprob):
+                order.append((key,None,slot))
+                nodes[key]=leaf(positive)
+            else:
+                op=rng.choice([AddNode,MultiplyNode,DivideNode] if positive else ops)
+                order.append((key,op,slot))
+                stack.append((level+1,(key,1),positive or op is DivideNode))
+                stack.append((level+1,(key,0),positive))
+        # Build the operations bottom-up from the collected children
+        children={}
+        for key,op,slot in reversed(order):
+            if op is not None:
+                nodes[key]=op(children.pop((key,0)),children.pop((key,1)))
+            if slot is not None:
+                children[slot]=nodes[key]
+        terms.append(nodes[0])
+    expr=terms[0]
+    for term in terms[1:]:
+        expr=AddNode(expr,term)
+    return expr
+
+# Values for the variables of randomExpression
+def randomPoint(nvars=3,seed=0):
+    rng=random.Random(seed)
+    return {'x%d' % i:rng.uniform(0.5,1.5) for i in range(nvars)}
+
+#---Operations-----------------------------------------------------------------
+
+# Every operation is a function that gets the arguments of randomExpression and returns a function to measure
+# The setup (e.g. building the tree) is not measured, and it is done again for every run, so caches
+# (e.g. of diff, __hash__ and fromString) of an earlier run are not used
+
+def tokenizeOperation(*args):
+    string=str(randomExpression(*args))
+    return lambda: tokenize(string)
+
+def fromStringOperation(*args):
+    string=str(randomExpression(*args))
+    ParseCache.default.clear()
+    return lambda: Expression.fromString(string)
+
+def evaluateOperation(*args):
+    expr=randomExpression(*args)
+    point=randomPoint(args[2] if len(args)>2 else 3)
+    return lambda: expr.evaluate(point)
+
+def diffOperation(*args):
+    expr=randomExpression(*args)
+    return lambda: expr.diff('x0')
+
+def strOperation(*args):
+    expr=randomExpression(*args)
+    return lambda: str(expr)
+
+# Compares two equal (but not identical) trees
+def eqOperation(*args):
+    a=randomExpression(*args)
+    b=randomExpression(*args)
+    return lambda: a==b
+
+Operations={'tokenize':tokenizeOperation,'fromString':fromStringOperation,'evaluate':evaluateOperation,
+            'diff':diffOperation,'str':strOperation,'eq':eqOperation}
+
+#---END Operations-------------------------------------------------------------
+
+# Time (the best of repeat runs) and peak memory (in bytes, above the memory in use before the run) of an operation
+def measure(operation,args,repeat=3):
+    best=None
+    for i in range(repeat):
+        func=operation(*args)
+        start=time.perf_counter()
+        func()
+        elapsed=time.perf_counter()-start
+        best=elapsed if best is None else min(best,elapsed)
+    func=operation(*args)
+    tracemalloc.start()
+    before=tracemalloc.get_traced_memory()[0]
+    func()
+    peak=tracemalloc.get_traced_memory()[1]-before
+    tracemalloc.stop()
+    return best,peak
+
+# Runs all operations on expressions of the given sizes (tuples of depth, width, nvars), returns the results
+def runSuite(sizes=((4,1,3),(6,4,3),(8,16,5),(10,64,10)),operations=None,repeat=3,seed=0):
+    operations=operations or list(Operations)
+    results=[]
+    print('%12s %8s %8s %8s %10s %14s %14s' % ('operation','depth','width','nvars','nodes','time (s)','peak (B)'))
+    for depth,width,nvars in sizes:
+        nodes=randomExpression(depth,width,nvars,seed).size()
+        for name in operations:
+            elapsed,peak=measure(Operations[name],(depth,width,nvars,seed),repeat)
+            results.append({'operation':name,'depth':depth,'width':width,'nvars':nvars,'nodes':nodes,'time':elapsed,'peak':peak})
+            print('%12s %8d %8d %8d %10d %14.6f %14d' % (name,depth,width,nvars,nodes,elapsed,peak))
+    return results
+
+# Saves results as JSON, together with the versions of Python and the platform
+def saveResults(results,filename):
+    data={'python':sys.version,'platform':platform.platform(),'date':time.strftime('%Y-%m-%d %H:%M:%S'),'results':results}
+    with open(filename,'w') as file:
+        json.dump(data,file,indent=1)
+
+# Compares results with the results in a JSON file of an earlier run: the ratio of the times and of the memory
+# (a ratio above 1 means slower or more memory now)
+def compareResults(results,filename):
+    with open(filename) as file:
+        earlier={(r['operation'],r['depth'],r['width'],r['nvars']):r for r in json.load(file)['results']}
+    print('%12s %10s %12s %12s' % ('operation','nodes','time ratio','peak ratio'))
+    for r in results:
+        old=earlier.get((r['operation'],r['depth'],r['width'],r['nvars']))
+        if old is not None:
+            print('%12s %10d %12.2f %12.2f' % (r['operation'],r['nodes'],r['time']/max(old['time'],1e-12),r['peak']/max(old['peak'],1)))
+
+
+if __name__=='__main__':
+    results=runSuite()
+    if len(sys.argv)>1:
+        saveResults(results,sys.argv[1])
+    if len(sys.argv)>2:
+        compareResults(results,sys.argv[2])
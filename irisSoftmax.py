@@ -0,0 +1,23 @@
+import time
+import numpy as np
+from readIrisData import X, y, classes
+from logistic import train, softmaxLossGradient, softmaxLoss, softmaxPredict
+
+# Multiclass (softmax) classification of the Iris data set (see readIrisData.py and logistic.py)
+# Reports the training time, the number of passes over the data, the throughput and the accuracy,
+# as a baseline for the trainers
+
+# features with mean 0 and standard deviation 1
+Z = (X - X.mean(axis=0))/X.std(axis=0)
+m, n = Z.shape
+k = len(classes)
+
+print('%d samples, %d features, %d classes' % (m, n, k))
+print('%10s %8s %10s %12s %16s %10s' % ('method', 'batch', 'passes', 'time (s)', 'samples/s', 'accuracy'))
+for method, batchsize in [('gd', None), ('adam', None), ('adam', 16)]:
+    start = time.perf_counter()
+    p, history = train(np.zeros((n+1)*k), Z, y, method=method, batchsize=batchsize, epochs=1000, tol=1e-3,
+                       lossgradient=softmaxLossGradient, loss=softmaxLoss)
+    elapsed = time.perf_counter() - start
+    accuracy = np.mean(softmaxPredict(p, Z) == y)
+    print('%10s %8d %10d %12.4f %16.0f %10.3f' % (method, batchsize or m, len(history), elapsed, len(history)*m/elapsed, accuracy))
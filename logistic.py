@@ -0,0 +1,161 @@
+import numpy as np
+
+# Logistic regression with the least-squares misfit of voorbeeld(1).py:
+#   f(p) = sum((sigmoid(X w + b) - y)**2), with the weights w = p[:-1] and the bias b = p[-1]
+
+# Numerically stable sigmoid: 1/(1+exp(-x)) for x >= 0 and exp(x)/(1+exp(x)) for x < 0,
+# so exp is only computed for values <= 0 and never overflows
+# If out is given, the result is written there (out may be x itself), else a number x gives a number
+def sigmoid(x, out=None):
+    x = np.asarray(x, dtype=np.float64)
+    negative = x < 0
+    # e = exp(-|x|) (with out arrays, also for a number x, which is a 0-d array here)
+    e = np.abs(x, out=np.empty_like(x))
+    np.negative(e, out=e)
+    np.exp(e, out=e)
+    scalar = out is None and x.ndim == 0
+    out = np.add(e, 1, out=np.empty_like(x) if out is None else out)
+    np.reciprocal(out, out=out)
+    np.multiply(out, e, out=out, where=negative)
+    return out[()] if scalar else out
+
+# Misfit and gradient in one pass: the forward pass (one matrix-vector product X w) is shared,
+# the gradient is one vector-matrix product t X, with t = 2 (yt - y) yt (1 - yt)
+# Besides the result there are only a few temporaries of the length of y (no temporaries of the size of X)
+def misfitGradient(p, X, y):
+    s = np.asarray(X @ p[:-1], dtype=np.float64)
+    s += p[-1]
+    yt = sigmoid(s, out=s)
+    residual = yt - y
+    f = residual @ residual
+    # t = 2 (yt - y) yt (1 - yt)
+    t = np.subtract(1, yt)
+    t *= yt
+    t *= residual
+    t *= 2
+    g = np.empty(len(p))
+    g[:-1] = t @ X
+    g[-1] = t.sum()
+    return f, g
+
+# Only the misfit (one forward pass), e.g. for the line search of train
+def misfit(p, X, y):
+    yt = sigmoid(np.asarray(X @ p[:-1], dtype=np.float64) + p[-1])
+    yt -= y
+    return yt @ yt
+
+#---Softmax (multiclass)------------------------------------------------------
+
+# Multiclass model with k classes: the probabilities of the classes are softmax(X W + b), with the weights W
+# (n x k) and biases b (k), stored in one vector p = [W; b].ravel() of length (n+1) k (so train can be used)
+# The labels y are 1, ..., k (as in readIrisData.py), the misfit is the cross entropy -sum(log(probability of y))
+
+# Cross entropy and its gradient in one pass, for all classes at once: the gradient of the scores is P - Y
+# (P the probabilities, Y the one-hot labels), so the gradient is [X^T (P - Y); sum(P - Y)]
+# For numerical stability the maximum of every row of the scores is subtracted before exp
+def softmaxLossGradient(p, X, y):
+    m, n = X.shape
+    W = p.reshape(n+1, -1)
+    S = X @ W[:-1]
+    S += W[-1]
+    S -= S.max(axis=1, keepdims=True)
+    rows = np.arange(m)
+    labels = np.asarray(y, dtype=np.int64) - 1
+    # log(probability of y) = score of y - log(sum(exp(scores))), with the shifted scores
+    true = S[rows, labels]
+    np.exp(S, out=S)
+    total = S.sum(axis=1)
+    f = np.sum(np.log(total)) - np.sum(true)
+    S /= total[:, None]
+    S[rows, labels] -= 1
+    G = np.empty_like(W)
+    G[:-1] = X.T @ S
+    G[-1] = S.sum(axis=0)
+    return f, G.ravel()
+
+# Only the cross entropy, e.g. for the line search of train
+def softmaxLoss(p, X, y):
+    return softmaxLossGradient(p, X, y)[0]
+
+# Predicted labels (1, ..., k): the classes with the highest scores
+def softmaxPredict(p, X):
+    W = p.reshape(X.shape[1]+1, -1)
+    return np.argmax(X @ W[:-1] + W[-1], axis=1) + 1
+
+#---END Softmax----------------------------------------------------------------
+
+#---Trainer--------------------------------------------------------------------
+
+# Trains the parameters p (weights and bias) of the model on the data X, y, e.g.
+# p, history = train(np.zeros(X.shape[1]+1), X, y, method='adam', batchsize=256, logevery=10)
+# Every epoch is one pass over the data in shuffled mini-batches of batchsize samples (default: all samples),
+# with one step per batch. The steps use the mean gradient of the batch (the gradient divided by
+# the size of the batch), so the step sizes do not depend on the number of samples:
+#   'gd': gradient descent with a backtracking line search (the step alpha is halved until the misfit of the
+#         batch decreases enough, and the next step starts from the accepted step, or from twice the accepted
+#         step for full batches)
+#   'momentum': gradient descent with momentum beta1 and step alpha
+#   'adam': Adam with step alpha and decay rates beta1 and beta2
+# Training stops after epochs passes, or earlier when the norm of the gradient of the epoch (the sum of the
+# gradients of its batches, for one batch the gradient of the misfit) is at most tol
+# Every logevery epochs (0: never) the epoch, the misfit and the norm of the gradient are printed
+# Returns the trained parameters and the history: a list of (epoch, misfit, gradient norm) per epoch,
+# where the misfit of an epoch is the sum of the misfits of its batches
+def train(p, X, y, method='adam', alpha=None, batchsize=None, epochs=1000, tol=1e-6, logevery=0,
+          beta1=0.9, beta2=0.999, seed=0, lossgradient=misfitGradient, loss=misfit):
+    if method not in ['gd', 'momentum', 'adam']:
+        raise ValueError('Unknown method: %s' % method)
+    if alpha is None:
+        alpha = {'gd': 1.0, 'momentum': 0.1, 'adam': 0.01}[method]
+    p = np.array(p, dtype=np.float64)
+    m = len(y)
+    batchsize = batchsize or m
+    rng = np.random.default_rng(seed)
+    # state of the methods
+    step = alpha
+    v = np.zeros_like(p)
+    s = np.zeros_like(p)
+    t = 0
+    history = []
+    for epoch in range(1, epochs+1):
+        order = rng.permutation(m) if batchsize < m else None
+        f = 0.0
+        gradient = np.zeros_like(p)
+        for start in range(0, m, batchsize):
+            if order is None:
+                Xb, yb = X, y
+            else:
+                batch = order[start:start+batchsize]
+                Xb, yb = X[batch], y[batch]
+            fb, gb = lossgradient(p, Xb, yb)
+            f += fb
+            gradient += gb
+            g = gb/len(yb)
+            if method == 'gd':
+                # backtracking (Armijo condition) on the mean misfit of the batch
+                gg = g @ g
+                while step > 1e-12 and loss(p - step*g, Xb, yb)/len(yb) > fb/len(yb) - 1e-4*step*gg:
+                    step /= 2
+                p -= step*g
+                if order is None:
+                    step *= 2
+            elif method == 'momentum':
+                v *= beta1
+                v += g
+                p -= alpha*v
+            else:
+                t += 1
+                v *= beta1
+                v += (1-beta1)*g
+                s *= beta2
+                s += (1-beta2)*g*g
+                p -= alpha*(v/(1-beta1**t))/(np.sqrt(s/(1-beta2**t)) + 1e-8)
+        norm = np.sqrt(gradient @ gradient)
+        history.append((epoch, f, norm))
+        if logevery and epoch % logevery == 0:
+            print(epoch, f, norm)
+        if norm <= tol:
+            break
+    return p, history
+
+#---END Trainer----------------------------------------------------------------
@@ -1,23 +1,63 @@
-import csv
+import os
 import numpy as np
-# Test
 
-m = 150
-label = {"Iris-setosa" : 1, "Iris-versicolor" : 2, "Iris-virginica" : 3}
-X = np.zeros((150,4))
-y = np.zeros(m)
+# Loads a data set from a CSV file with a header: one column with the index of the rows (index, default the first
+# column), one column with the labels (label, default the last column), the other columns are the features
+# Returns X (float64 array, one row per sample), y (integer array with the labels 1, 2, ...) and the names of the classes
+# (the label classes[k-1] is encoded as k, the classes are sorted)
+# The number of rows and columns and the classes are found from the file itself.
+# The parsed arrays are stored in a cache (a directory with .npy files next to the CSV file), so the next time
+# the arrays are loaded from there (memory-mapped and read-only if mmap is True) instead of parsing the file again.
+# The cache is parsed again when the CSV file is newer. Every choice of index and label has its own subdirectory
+# in the cache.
+def loadData(filename, index=0, label=-1, cache=True, mmap=True):
+	cachedir = os.path.join(os.path.splitext(filename)[0] + '.cache', 'index%s_label%s' % (index, label))
+	names = ['X', 'y', 'classes']
+	paths = [os.path.join(cachedir, name + '.npy') for name in names]
+	if cache and all(os.path.exists(path) and os.path.getmtime(path) >= os.path.getmtime(filename) for path in paths):
+		return tuple(np.load(path, mmap_mode='r' if mmap else None) for path in paths)
+
+	X, y, classes = parseData(filename, index, label)
+	if not cache:
+		return X, y, classes
+	os.makedirs(cachedir, exist_ok=True)
+	for path, array in zip(paths, [X, y, classes]):
+		np.save(path, array)
+	# the arrays are loaded from the cache, so they are of the same kind (e.g. read-only) as the next time
+	return tuple(np.load(path, mmap_mode='r' if mmap else None) for path in paths)
+
+# Parses the CSV file of loadData in one pass without a Python loop over the rows: the file is read by the
+# (compiled) parser of NumPy, which converts the numerical columns to float64, and the labels are encoded in the
+# same pass by a converter (numbered in order of appearance, and renumbered afterwards in the order of the classes)
+def parseData(filename, index=0, label=-1):
+	with open(filename) as csvfile:
+		header = csvfile.readline().strip().split(',')
+		# shape of the table
+		n = len(header)
+		index = index % n if index is not None else None
+		label = label % n
+		# features
+		features = [j for j in range(n) if j != index and j != label]
+		# (with the index and the labels in the same pass)
+		numbers = ([index] if index is not None else []) + features + [label]
+		codes = {}
+		table = np.loadtxt(csvfile, delimiter=',', usecols=numbers, dtype=np.float64, ndmin=2,
+				converters={label: lambda text: codes.setdefault(text, len(codes))})
+	# labels: classes[k-1] is encoded as k
+	classes = np.array(sorted(codes))
+	rank = np.empty(len(codes), dtype=np.int64)
+	rank[[codes[name] for name in classes]] = np.arange(1, len(codes)+1)
+	y = rank[table[:, -1].astype(np.int64)]
+	X = table[:, :-1]
+	# rows in the order of the index
+	if index is not None:
+		order = np.argsort(X[:, 0], kind='stable')
+		X = X[order, 1:]
+		y = y[order]
+	return np.ascontiguousarray(X), y, classes
+
+X, y, classes = loadData(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Iris.csv'))
+m = len(y)
 
-with open('Iris.csv', newline='') as csvfile:
-	     reader = csv.reader(csvfile, delimiter=',')
-	     # skip headers
-	     print(next(reader, None))
-	     # loop over rows
-	     for row in reader:
-	     	# index
-	     	k = int(row[0])-1
-	     	# features
-	     	X[k,:] = row[1:5]
-	     	# labels
-	     	y[k] = label[row[5]]
-	     	
 # Now, X contains 150 input samples with 4 features each and y contains 150 labels (1, 2, 3)
+# for the classes Iris-setosa, Iris-versicolor and Iris-virginica
@@ -1,23 +1,23 @@
 import numpy as np
-
-# sigmoid functie
-def sigmoid(x):
-    return 1/(1+np.exp(-x))
+# stabiele sigmoid, en misfit en gradient in een keer (zie logistic.py)
+from logistic import sigmoid, misfitGradient
 
 # misfit functie
 def misfit(p):
-    yt = sigmoid(np.dot(X,p[:-1]) + p[-1])
-    residual = yt - y
-    return np.dot(residual,residual)
+	return misfitGradient(p,X,y)[0]
 
 # gradient
 def gradient(p):
-	s = np.dot(X,p[:-1]) + p[-1]
-	yt = sigmoid(s)
-	g = np.zeros(len(p))
-	g[:-1] = 2*np.dot(np.transpose(X)*sigmoid(s)*(1 - sigmoid(s))*(yt - y),np.ones(len(yt)))
-	g[-1]  = 2*np.dot(sigmoid(s)*(1 - sigmoid(s))*(yt - y),np.ones(len(yt)))
-	return g
+	return misfitGradient(p,X,y)[1]
+
+# dezelfde gradient, afgeleid met automatische differentiatie (reverse mode) uit de expressie voor de misfit
+from ETV2 import Expression
+import math
+term = Expression.fromString('(1/(1+e**(-(p0*x0+p1*x1+p2)))-y)**2')
+def gradientAD(p):
+	env = {'e':math.e,'p0':p[0],'p1':p[1],'p2':p[2],'x0':X[:,0].astype(float),'x1':X[:,1].astype(float),'y':y.astype(float)}
+	f,g = term.gradient_array(env)
+	return np.array([np.sum(g['p0']),np.sum(g['p1']),np.sum(g['p2'])])
 	
 # invoer voor OF operatie
 X = np.array([  [0,0],
@@ -34,8 +34,9 @@ p = np.array([1,1,1])
 # doe aan aantal iteraties
 alpha = 1e1 # stapgrootte, kies deze zodat f steeds kleiner wordt
 for iter in range(200):
-	f = misfit(p)
-	g = gradient(p)
+	f,g = misfitGradient(p,X,y)
+	if iter == 0:
+		print('verschil met AD gradient:',np.max(np.abs(g - gradientAD(p))))
 	p = p - alpha*g
 	
 	# print
@@ -43,4 +44,9 @@ for iter in range(200):
 
 print('Weights               : ', p)
 print('Training data         : ', y)
-print('Output After Training : ', sigmoid(np.dot(X,p[:-1]) + p[-1]))
\ No newline at end of file
+print('Output After Training : ', sigmoid(np.dot(X,p[:-1]) + p[-1]))
+# hetzelfde probleem met de trainer van logistic.py: gradient descent met backtracking line search,
+# die stopt als de gradient klein genoeg is (zonder een stapgrootte te kiezen)
+from logistic import train
+q, history = train(np.array([1,1,1]), X, y, method='gd', tol=1e-4)
+print('Trainer: %d iteraties, misfit %g, gewichten %s' % (len(history), history[-1][1], q))